@@ -1,9 +1,7 @@
-import io
 from typing import List
 
 from fastapi import APIRouter, Depends, File, Header, HTTPException, UploadFile, status
 from fastapi.responses import JSONResponse
-from jose import jwt
 
 from src.dependencies import get_token_service, get_screenshot_service
 from src.models import ErrorResponse, ScreenshotUploadResult, TokenBlacklistReason, TokenPayload
@@ -12,6 +10,16 @@ from src.services.token_service import TokenService
 
 router = APIRouter(prefix="/api")
 
+# Error bodies for rejected tokens, built once rather than per request
+TOKEN_ALREADY_USED_ERROR = ErrorResponse(
+    message="Token has already been used",
+    detail="This upload token has already been used"
+).model_dump()
+OTHER_PEER_UPLOADED_ERROR = ErrorResponse(
+    message="Screenshots already uploaded",
+    detail="Another peer has already uploaded screenshots for this catalog ID"
+).model_dump()
+
 
 async def validate_token(
         authorization: str = Header(...),
@@ -25,43 +33,27 @@ async def validate_token(
         )
 
     token = authorization.split(" ")[1]
-    token_payload = token_service.validate_token(token)
-
-    if not token_payload:
-        # Check if token is blacklisted and provide specific error
-        token_id = None
-        try:
-            # Extract token_id from JWT without validation
-            payload = jwt.decode(token, options={"verify_signature": False})
-            token_id = payload.get("token_id")
-        except Exception:
-            pass
-
-        if token_id:
-            reason = token_service.get_blacklist_reason(token_id)
-            if reason == TokenBlacklistReason.ALREADY_USED:
-                return JSONResponse(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    content=ErrorResponse(
-                        message="Token has already been used",
-                        detail="This upload token has already been used"
-                    ).model_dump()
-                )
-            elif reason == TokenBlacklistReason.OTHER_PEER_UPLOADED:
-                return JSONResponse(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    content=ErrorResponse(
-                        message="Screenshots already uploaded",
-                        detail="Another peer has already uploaded screenshots for this catalog ID"
-                    ).model_dump()
-                )
+    result = await token_service.validate_token(token)
 
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
+    if result.payload is not None:
+        return result.payload
+
+    # Provide specific error if token is blacklisted
+    if result.reason == TokenBlacklistReason.ALREADY_USED:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content=TOKEN_ALREADY_USED_ERROR
+        )
+    elif result.reason == TokenBlacklistReason.OTHER_PEER_UPLOADED:
+        return JSONResponse(
+            status_code=status.HTTP_403_FORBIDDEN,
+            content=OTHER_PEER_UPLOADED_ERROR
         )
 
-    return token_payload
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired token"
+    )
 
 
 @router.post("/screenshot/{catalog_id}", response_model=ScreenshotUploadResult)
@@ -82,18 +74,21 @@ async def upload_screenshots(
     # Process files
     screenshot_files = []
     content_types = []
+    file_sizes = []
 
     for file in files:
-        # Read file content
-        content = await file.read()
-        screenshot_files.append(io.BytesIO(content))
+        # Pass the spooled upload file through so it is streamed to storage;
+        # its size is already known from parsing the form
+        screenshot_files.append(file.file)
         content_types.append(file.content_type)
+        file_sizes.append(file.size)
 
     # Process screenshot upload
-    screenshot_urls = screenshot_service.process_screenshot_upload(
+    screenshot_urls = await screenshot_service.process_screenshot_upload(
         token_payload,
         screenshot_files,
-        content_types
+        content_types,
+        file_sizes
     )
 
     # Return result
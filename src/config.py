@@ -12,6 +12,8 @@ class KafkaConfig(BaseModel):
         default_factory=lambda: os.environ.get("KAFKA_SCREENSHOTS_COMPLETED_TOPIC", "media.screenshots.completed"))
     peer_available_topic: str = Field(
         default_factory=lambda: os.environ.get("KAFKA_PEER_AVAILABLE_TOPIC", "peer.available.with_requested_media"))
+    producer_linger_ms: int = Field(
+        default_factory=lambda: int(os.environ.get("KAFKA_PRODUCER_LINGER_MS", "20")))
 
 
 class RedisConfig(BaseModel):
@@ -19,10 +21,15 @@ class RedisConfig(BaseModel):
     port: int = Field(default_factory=lambda: int(os.environ.get("REDIS_PORT", "6379")))
     db: int = Field(default_factory=lambda: int(os.environ.get("REDIS_DB", "0")))
     password: str = Field(default_factory=lambda: os.environ.get("REDIS_PASSWORD", ""))
+    max_connections: int = Field(default_factory=lambda: int(os.environ.get("REDIS_MAX_CONNECTIONS", "200")))
+    health_check_interval: int = Field(
+        default_factory=lambda: int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", "30")))
     token_blacklist_prefix: str = Field(
         default_factory=lambda: os.environ.get("REDIS_TOKEN_BLACKLIST_PREFIX", "screenshot:token:blacklist:"))
     pending_requests_prefix: str = Field(
         default_factory=lambda: os.environ.get("REDIS_PENDING_REQUESTS_PREFIX", "screenshot:pending:"))
+    pending_catalogs_index_key: str = Field(
+        default_factory=lambda: os.environ.get("REDIS_PENDING_CATALOGS_INDEX_KEY", "screenshot:pending-catalogs"))
 
 
 class MinioConfig(BaseModel):
@@ -31,12 +38,30 @@ class MinioConfig(BaseModel):
     secret_key: str = Field(default_factory=lambda: os.environ.get("MINIO_SECRET_KEY", "minioadmin"))
     secure: bool = Field(default_factory=lambda: os.environ.get("MINIO_SECURE", "false").lower() == "true")
     bucket_name: str = Field(default_factory=lambda: os.environ.get("MINIO_BUCKET_NAME", "screenshots"))
+    part_size: int = Field(default_factory=lambda: int(os.environ.get("MINIO_PART_SIZE", str(16 * 1024 * 1024))))
+    num_parallel_uploads: int = Field(default_factory=lambda: int(os.environ.get("MINIO_NUM_PARALLEL_UPLOADS", "4")))
+    max_connections: int = Field(default_factory=lambda: int(os.environ.get("MINIO_MAX_CONNECTIONS", "64")))
+    recompress_on_upload: bool = Field(
+        default_factory=lambda: os.environ.get("MINIO_RECOMPRESS_ON_UPLOAD", "false").lower() == "true")
+    recompress_quality: int = Field(default_factory=lambda: int(os.environ.get("MINIO_RECOMPRESS_QUALITY", "85")))
+    recompress_min_jpeg_size: int = Field(
+        default_factory=lambda: int(os.environ.get("MINIO_RECOMPRESS_MIN_JPEG_SIZE", str(2 * 1024 * 1024))))
 
 
 class JWTConfig(BaseModel):
     secret_key: str = Field(default_factory=lambda: os.environ.get("JWT_SECRET_KEY", "secret"))
     algorithm: str = Field(default_factory=lambda: os.environ.get("JWT_ALGORITHM", "HS256"))
     token_expire_minutes: int = Field(default_factory=lambda: int(os.environ.get("JWT_TOKEN_EXPIRE_MINUTES", "30")))
+    validation_cache_size: int = Field(
+        default_factory=lambda: int(os.environ.get("JWT_VALIDATION_CACHE_SIZE", "10000")))
+    validation_cache_ttl_seconds: int = Field(
+        default_factory=lambda: int(os.environ.get("JWT_VALIDATION_CACHE_TTL_SECONDS", "30")))
+    blacklist_cache_size: int = Field(
+        default_factory=lambda: int(os.environ.get("JWT_BLACKLIST_CACHE_SIZE", "10000")))
+    blacklist_cache_ttl_seconds: int = Field(
+        default_factory=lambda: int(os.environ.get("JWT_BLACKLIST_CACHE_TTL_SECONDS", "1800")))
+    fast_signing: bool = Field(
+        default_factory=lambda: os.environ.get("JWT_FAST_SIGNING", "true").lower() == "true")
 
 
 class ServiceConfig(BaseModel):
@@ -48,6 +73,24 @@ class ServiceConfig(BaseModel):
         default_factory=lambda: int(os.environ.get("MAX_SCREENSHOTS_PER_REQUEST", "10")))
     pending_request_ttl_hours: int = Field(
         default_factory=lambda: int(os.environ.get("PENDING_REQUEST_TTL_HOURS", "24")))
+    http_max_connections: int = Field(
+        default_factory=lambda: int(os.environ.get("HTTP_MAX_CONNECTIONS", "200")))
+    http_max_keepalive_connections: int = Field(
+        default_factory=lambda: int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "100")))
+    http_timeout_seconds: float = Field(
+        default_factory=lambda: float(os.environ.get("HTTP_TIMEOUT_SECONDS", "10")))
+    edge_request_concurrency: int = Field(
+        default_factory=lambda: int(os.environ.get("EDGE_REQUEST_CONCURRENCY", "64")))
+    peer_cache_size: int = Field(
+        default_factory=lambda: int(os.environ.get("PEER_CACHE_SIZE", "4096")))
+    peer_cache_ttl_seconds: float = Field(
+        default_factory=lambda: float(os.environ.get("PEER_CACHE_TTL_SECONDS", "5")))
+    event_queue_size: int = Field(
+        default_factory=lambda: int(os.environ.get("EVENT_QUEUE_SIZE", "1024")))
+    event_workers: int = Field(
+        default_factory=lambda: int(os.environ.get("EVENT_WORKERS", "32")))
+    threadpool_size: int = Field(
+        default_factory=lambda: int(os.environ.get("THREADPOOL_SIZE", "100")))
 
 
 class AppConfig(BaseModel):
@@ -1,56 +1,79 @@
+from functools import lru_cache
+
+import httpx
 from fastapi import Depends
-from redis import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
 
 from src.config import config
 from src.services.kafka_service import KafkaService
 from src.services.redis_service import RedisService
-from src.services.screenshot_service import ScreenshotService
+from src.services.screenshot_service import ScreenshotService, create_http_client, create_peer_cache
 from src.services.storage_service import StorageService
 from src.services.token_service import TokenService
 
+# Shared across requests, since a ScreenshotService is built per request
+peer_cache = create_peer_cache()
+# Waits for a free connection once max_connections are in use instead of failing
+redis_pool = BlockingConnectionPool(
+    host=config.redis.host,
+    port=config.redis.port,
+    db=config.redis.db,
+    password=config.redis.password,
+    max_connections=config.redis.max_connections,
+    health_check_interval=config.redis.health_check_interval,
+    decode_responses=False  # We want bytes for token blacklist
+)
+
 
+@lru_cache(maxsize=1)
 def get_redis_client() -> Redis:
-    """Get Redis client."""
-    redis_config = config.redis
-    return Redis(
-        host=redis_config.host,
-        port=redis_config.port,
-        db=redis_config.db,
-        password=redis_config.password,
-        decode_responses=False  # We want bytes for token blacklist
-    )
+    """Get Redis client backed by the shared connection pool."""
+    return Redis(connection_pool=redis_pool)
 
 
+@lru_cache(maxsize=1)
 def get_token_service(redis_client: Redis = Depends(get_redis_client)) -> TokenService:
-    """Get TokenService instance."""
+    """Get shared TokenService instance."""
     return TokenService(redis_client)
 
 
+@lru_cache(maxsize=1)
 def get_redis_service(redis_client: Redis = Depends(get_redis_client)) -> RedisService:
-    """Get RedisService instance."""
+    """Get shared RedisService instance."""
     return RedisService(redis_client)
 
 
+@lru_cache(maxsize=1)
 def get_kafka_service() -> KafkaService:
-    """Get KafkaService instance."""
+    """Get shared KafkaService instance, so messages are batched on one producer."""
     return KafkaService()
 
 
+@lru_cache(maxsize=1)
 def get_storage_service() -> StorageService:
-    """Get StorageService instance."""
+    """Get shared StorageService instance, so MinIO connections are pooled across requests."""
     return StorageService()
 
 
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.AsyncClient:
+    """Get shared HTTP client for outbound service calls."""
+    return create_http_client()
+
+
 def get_screenshot_service(
         token_service: TokenService = Depends(get_token_service),
         redis_service: RedisService = Depends(get_redis_service),
         kafka_service: KafkaService = Depends(get_kafka_service),
-        storage_service: StorageService = Depends(get_storage_service)
+        storage_service: StorageService = Depends(get_storage_service),
+        http_client: httpx.AsyncClient = Depends(get_http_client)
 ) -> ScreenshotService:
     """Get ScreenshotService instance."""
     return ScreenshotService(
         token_service,
         redis_service,
         kafka_service,
-        storage_service
+        storage_service,
+        http_client,
+        peer_cache
     )
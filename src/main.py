@@ -4,11 +4,22 @@ import os
 from contextlib import asynccontextmanager
 from typing import Any
 
+import anyio.to_thread
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
 
 from src.api.routes import router
-from src.dependencies import get_kafka_service, get_screenshot_service
+from src.config import config
+from src.dependencies import (
+    get_http_client,
+    get_kafka_service,
+    get_redis_client,
+    get_redis_service,
+    get_screenshot_service,
+    get_storage_service,
+    get_token_service,
+    redis_pool,
+)
 from src.models import ErrorResponse
 
 # Configure logging
@@ -20,22 +31,57 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def _event_worker(queue: asyncio.Queue) -> None:
+    """Handle Kafka events from the queue one at a time."""
+    while True:
+        handler, event = await queue.get()
+        try:
+            await handler(event)
+        except Exception as e:
+            logger.error(f"Error handling Kafka event: {e}")
+        finally:
+            queue.task_done()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle events"""
     # Startup logic
     logger.info("Starting Screenshot Service...")
 
-    # Get service instances
+    # Size the shared threadpool used for blocking MinIO calls
+    anyio.to_thread.current_default_thread_limiter().total_tokens = config.service.threadpool_size
+
+    # Get service instances; outside a request FastAPI does not resolve
+    # dependencies, so the shared instances are passed in explicitly, by
+    # keyword to hit the same cache entries as the routes
     kafka_service = get_kafka_service()
-    screenshot_service = get_screenshot_service()
+    redis_client = get_redis_client()
+    screenshot_service = get_screenshot_service(
+        token_service=get_token_service(redis_client=redis_client),
+        redis_service=get_redis_service(redis_client=redis_client),
+        kafka_service=kafka_service,
+        storage_service=get_storage_service(),
+        http_client=get_http_client()
+    )
+
+    # Bounded queue drained by a fixed pool of workers, so bursts of Kafka
+    # events cannot spawn an unbounded number of tasks
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=config.service.event_queue_size)
+    workers = [asyncio.create_task(_event_worker(queue)) for _ in range(config.service.event_workers)]
 
-    # Create handler functions that don't return anything
+    # Handlers run on the Kafka consumer thread and block it while the queue
+    # is full, which pauses consumption until the workers catch up
     def handle_screenshot_request(request: Any) -> None:
-        asyncio.create_task(screenshot_service.handle_screenshot_request(request))
+        asyncio.run_coroutine_threadsafe(
+            queue.put((screenshot_service.handle_screenshot_request, request)), loop
+        ).result()
 
     def handle_peer_available(peer: Any) -> None:
-        asyncio.create_task(screenshot_service.handle_peer_available(peer))
+        asyncio.run_coroutine_threadsafe(
+            queue.put((screenshot_service.handle_peer_available, peer)), loop
+        ).result()
 
     # Start Kafka consumer with proper function signature
     kafka_service.start_consuming(
@@ -49,7 +95,18 @@ async def lifespan(app: FastAPI):
 
     # Shutdown logic
     logger.info("Shutting down Screenshot Service...")
-    kafka_service.stop_consuming()
+    # Join the consumer thread off the loop, so a handler waiting on the queue can finish
+    await asyncio.to_thread(kafka_service.stop_consuming)
+
+    # Let workers finish queued events before stopping them
+    await queue.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+    kafka_service.close()
+    await get_http_client().aclose()
+    await redis_pool.disconnect()
     logger.info("Screenshot Service shutdown complete")
 
 
@@ -84,10 +141,15 @@ if __name__ == "__main__":
     import uvicorn
 
     port = int(os.environ.get("PORT", "8000"))
+    workers = int(os.environ.get("WORKERS", str(os.cpu_count() or 1)))
+    reload = os.environ.get("RELOAD", "false").lower() == "true"
 
     uvicorn.run(
         "src.main:app",  # Adjust this path based on where main.py is located
         host="0.0.0.0",
         port=port,
-        reload=True  # Set to False in production
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        reload=reload  # Reloading runs a single worker
     )
@@ -2,7 +2,7 @@ from datetime import datetime
 from enum import Enum
 from typing import List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class TokenBlacklistReason(str, Enum):
@@ -20,6 +20,9 @@ class ScreenshotRequest(BaseModel):
 
 
 class TokenPayload(BaseModel):
+    # Immutable, since validated payloads are cached and shared between requests
+    model_config = ConfigDict(frozen=True)
+
     peer_id: str
     catalog_id: str
     request_id: str
@@ -27,7 +30,15 @@ class TokenPayload(BaseModel):
     exp: datetime
 
 
+class TokenValidationResult(BaseModel):
+    payload: Optional[TokenPayload] = None
+    token_id: Optional[str] = None
+    reason: Optional[TokenBlacklistReason] = None
+
+
 class ScreenshotTokenInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     token: str
     peer_id: str
     catalog_id: str
@@ -36,6 +47,9 @@ class ScreenshotTokenInfo(BaseModel):
 
 
 class PeerWithMedia(BaseModel):
+    # Immutable, since cached Peer Registry lookups are shared between requests
+    model_config = ConfigDict(frozen=True)
+
     peer_id: str
     edge_id: str
     catalog_ids: List[str]
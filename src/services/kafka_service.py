@@ -1,8 +1,8 @@
-import json
 import logging
 import threading
 from typing import Callable, Dict, List, Any
 
+import orjson
 from confluent_kafka import Consumer, Producer, KafkaError, KafkaException
 
 from src.config import config
@@ -10,14 +10,33 @@ from src.models import PeerWithMedia, ScreenshotRequest
 
 logger = logging.getLogger(__name__)
 
+# Attempts to enqueue a message while the local producer queue is full
+PRODUCE_RETRY_ATTEMPTS = 3
+
+# Maximum number of messages fetched per consume call
+CONSUME_BATCH_SIZE = 500
+
+# Seconds a consume call waits when idle; arriving messages return immediately,
+# so this only bounds how quickly the loop notices it should stop
+CONSUME_TIMEOUT = 0.5
+
 
 class KafkaService:
     def __init__(self):
         self.kafka_config = config.kafka
         self.producer = Producer({
             'bootstrap.servers': self.kafka_config.bootstrap_servers,
-            'client.id': f'{self.kafka_config.group_id}-producer'
+            'client.id': f'{self.kafka_config.group_id}-producer',
+            'linger.ms': self.kafka_config.producer_linger_ms,
+            'batch.num.messages': 10000,
+            'queue.buffering.max.kbytes': 1048576,
+            'compression.type': 'lz4',
+            # One delivery callback for the producer, invoked only for failures
+            'on_delivery': self._delivery_report,
+            'delivery.report.only.error': True
         })
+        # Resolved once, since it is published to on every completed upload
+        self._completed_topic = self.kafka_config.screenshots_completed_topic
         self.consumer = None
         self.running = False
         self.consumer_thread = None
@@ -32,33 +51,35 @@ class KafkaService:
             'status': 'completed'
         }
 
-        self._publish_message(self.kafka_config.screenshots_completed_topic, message)
+        self._publish_message(self._completed_topic, message)
 
     def _publish_message(self, topic: str, message: Dict[str, Any]) -> None:
         """Publish a message to a Kafka topic."""
         try:
-            # Convert message to JSON
-            message_json = json.dumps(message)
-
-            # Publish message
-            self.producer.produce(
-                topic,
-                value=message_json.encode('utf-8'),
-                callback=self._delivery_report
-            )
+            # Convert message to JSON bytes
+            message_json = orjson.dumps(message)
 
-            # Flush to ensure message is sent
-            self.producer.flush()
+            # Publish message; librdkafka batches it in the background
+            for _ in range(PRODUCE_RETRY_ATTEMPTS):
+                try:
+                    self.producer.produce(topic, value=message_json)
+                    break
+                except BufferError:
+                    # Local queue is full, wait for deliveries to free space
+                    self.producer.poll(1.0)
+            else:
+                logger.error(f"Failed to publish message to {topic}: producer queue is full")
+                return
+
+            # Serve delivery reports without blocking
+            self.producer.poll(0)
 
         except Exception as e:
             logger.error(f"Failed to publish message to {topic}: {e}")
 
     def _delivery_report(self, err, msg) -> None:
-        """Callback for message delivery reports."""
-        if err is not None:
-            logger.error(f'Message delivery failed: {err}')
-        else:
-            logger.debug(f'Message delivered to {msg.topic()} [{msg.partition()}]')
+        """Callback for failed deliveries; successful ones are not reported."""
+        logger.error(f'Message delivery failed: {err}')
 
     def start_consuming(self,
                         screenshots_requested_handler: Callable[[ScreenshotRequest], None],
@@ -73,7 +94,10 @@ class KafkaService:
         self.consumer = Consumer({
             'bootstrap.servers': self.kafka_config.bootstrap_servers,
             'group.id': self.kafka_config.group_id,
-            'auto.offset.reset': 'earliest'
+            'auto.offset.reset': 'earliest',
+            'fetch.min.bytes': 65536,
+            'fetch.wait.max.ms': 50,
+            'queued.min.messages': 10000
         })
 
         # Subscribe to topics
@@ -94,41 +118,40 @@ class KafkaService:
                       screenshots_requested_handler: Callable[[ScreenshotRequest], None],
                       peer_available_handler: Callable[[PeerWithMedia], None]) -> None:
         """Main consumer loop."""
+        # Map each topic to its bound decoder and handler once, rather than per message
+        topic_handlers = {
+            self.kafka_config.screenshots_requested_topic: (
+                ScreenshotRequest.model_validate_json, screenshots_requested_handler),
+            self.kafka_config.peer_available_topic: (
+                PeerWithMedia.model_validate_json, peer_available_handler),
+        }
+
         try:
             while self.running:
-                # Poll for messages
-                msg = self.consumer.poll(timeout=1.0)
-
-                if msg is None:
-                    continue
-
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        # End of partition event - not an error
-                        continue
-                    else:
-                        logger.error(f"Kafka consumer error: {msg.error()}")
+                # Fetch a batch of messages in a single call
+                msgs = self.consumer.consume(num_messages=CONSUME_BATCH_SIZE, timeout=CONSUME_TIMEOUT)
+
+                for msg in msgs:
+                    if msg.error():
+                        if msg.error().code() == KafkaError._PARTITION_EOF:
+                            # End of partition event - not an error
+                            continue
+                        else:
+                            logger.error(f"Kafka consumer error: {msg.error()}")
+                            continue
+
+                    topic_handler = topic_handlers.get(msg.topic())
+                    if topic_handler is None:
                         continue
 
-                # Process message
-                try:
-                    # Parse message
-                    message_json = msg.value().decode('utf-8')
-                    message = json.loads(message_json)
+                    # Process message
+                    try:
+                        # Parse the raw bytes directly into the topic's model
+                        decode, handler = topic_handler
+                        handler(decode(msg.value()))
 
-                    # Handle message based on topic
-                    if msg.topic() == self.kafka_config.screenshots_requested_topic:
-                        # Create screenshot request
-                        request = ScreenshotRequest(**message)
-                        screenshots_requested_handler(request)
-
-                    elif msg.topic() == self.kafka_config.peer_available_topic:
-                        # Create peer with media
-                        peer = PeerWithMedia(**message)
-                        peer_available_handler(peer)
-
-                except Exception as e:
-                    logger.error(f"Failed to process message: {e}")
+                    except Exception as e:
+                        logger.error(f"Failed to process message: {e}")
 
         except KafkaException as e:
             logger.error(f"Kafka exception: {e}")
@@ -140,3 +163,9 @@ class KafkaService:
         self.running = False
         if self.consumer_thread:
             self.consumer_thread.join(timeout=5.0)
+
+    def close(self) -> None:
+        """Deliver any queued messages before shutdown."""
+        remaining = self.producer.flush(30)
+        if remaining:
+            logger.error(f"{remaining} messages were not delivered before shutdown")
@@ -1,75 +1,92 @@
-import json
-from datetime import datetime, timedelta
-from typing import List, Set
+import time
+from datetime import timedelta
+from typing import Dict, List, Set
 
-from redis import Redis
+from redis.asyncio import Redis
 
 from src.config import config
 from src.models import ScreenshotRequest
 
+# Deletes a pending request and drops its catalog from the index once no
+# requests are left, atomically so a concurrent add is never unindexed
+REMOVE_PENDING_REQUEST_SCRIPT = """
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('ZREM', KEYS[2], ARGV[2])
+end
+"""
+
 
 class RedisService:
     def __init__(self, redis_client: Redis):
         self.redis_client = redis_client
         self.redis_config = config.redis
         self.service_config = config.service
+        # Key builder bound once, instead of formatting the prefix on every call
+        self._pending_key = (self.redis_config.pending_requests_prefix + "{}").format
+        self._index_key = self.redis_config.pending_catalogs_index_key
+        self._default_ttl = timedelta(hours=self.service_config.pending_request_ttl_hours)
+        self._remove_pending_request = redis_client.register_script(REMOVE_PENDING_REQUEST_SCRIPT)
 
-    def add_pending_request(self, request: ScreenshotRequest) -> None:
+    async def add_pending_request(self, request: ScreenshotRequest) -> None:
         """Add a pending screenshot request."""
         # Set expiration time if not already set
         if not request.expires_at:
-            request.expires_at = request.created_at + timedelta(
-                hours=self.service_config.pending_request_ttl_hours
-            )
+            request.expires_at = request.created_at + self._default_ttl
+
+        # Skip already expired requests before doing any serialization
+        expires_at = request.expires_at.timestamp()
+        ttl_seconds = int(expires_at - time.time())
+        if ttl_seconds <= 0:
+            return
 
         # Create Redis key
-        catalog_key = f"{self.redis_config.pending_requests_prefix}{request.catalog_id}"
+        catalog_key = self._pending_key(request.catalog_id)
 
         # Serialize request to JSON
         request_json = request.model_dump_json()
 
-        # Store in Redis with expiration
-        ttl_seconds = int((request.expires_at - datetime.now()).total_seconds())
-        if ttl_seconds > 0:
-            self.redis_client.hset(catalog_key, request.request_id, request_json)
-            self.redis_client.expire(catalog_key, ttl_seconds)
+        # Store in Redis with expiration, sending all commands in a single round trip;
+        # the index entry is scored by the hash's expiry so expired catalogs can be dropped
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(catalog_key, request.request_id, request_json)
+        pipe.expire(catalog_key, ttl_seconds)
+        pipe.zadd(self._index_key, {request.catalog_id: expires_at})
+        await pipe.execute()
 
-    def get_pending_requests(self, catalog_id: str) -> List[ScreenshotRequest]:
+    async def get_pending_requests(self, catalog_id: str) -> List[ScreenshotRequest]:
         """Get all pending requests for a catalog_id."""
-        catalog_key = f"{self.redis_config.pending_requests_prefix}{catalog_id}"
+        catalog_key = self._pending_key(catalog_id)
 
-        # Get all requests from Redis hash
-        requests_json = self.redis_client.hgetall(catalog_key)
+        # Get all requests from Redis hash; field names are not needed
+        requests_json = await self.redis_client.hvals(catalog_key)
 
-        # Parse requests
-        requests = []
-        for request_json in requests_json.values():
-            request_dict = json.loads(request_json)
-            # Convert string dates back to datetime objects
-            if isinstance(request_dict["created_at"], str):
-                request_dict["created_at"] = datetime.fromisoformat(request_dict["created_at"])
-            if request_dict.get("expires_at") and isinstance(request_dict["expires_at"], str):
-                request_dict["expires_at"] = datetime.fromisoformat(request_dict["expires_at"])
+        # Parse requests straight from the stored JSON, including datetimes
+        return [ScreenshotRequest.model_validate_json(request_json) for request_json in requests_json]
 
-            requests.append(ScreenshotRequest(**request_dict))
+    async def get_pending_requests_bulk(self, catalog_ids: List[str]) -> Dict[str, List[ScreenshotRequest]]:
+        """Get all pending requests for several catalog_ids in a single round trip."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for catalog_id in catalog_ids:
+            pipe.hvals(self._pending_key(catalog_id))
 
-        return requests
+        return {
+            catalog_id: [ScreenshotRequest.model_validate_json(request_json) for request_json in requests_json]
+            for catalog_id, requests_json in zip(catalog_ids, await pipe.execute())
+        }
 
-    def remove_pending_request(self, catalog_id: str, request_id: str) -> None:
+    async def remove_pending_request(self, catalog_id: str, request_id: str) -> None:
         """Remove a pending request."""
-        catalog_key = f"{self.redis_config.pending_requests_prefix}{catalog_id}"
-        self.redis_client.hdel(catalog_key, request_id)
+        catalog_key = self._pending_key(catalog_id)
+        await self._remove_pending_request(keys=[catalog_key, self._index_key], args=[request_id, catalog_id])
 
-    def get_all_pending_catalog_ids(self) -> Set[str]:
+    async def get_all_pending_catalog_ids(self) -> Set[str]:
         """Get all catalog_ids with pending requests."""
-        # Get all keys matching the prefix
-        keys = self.redis_client.keys(f"{self.redis_config.pending_requests_prefix}*")
-
-        # Extract catalog_ids from keys
-        catalog_ids = set()
-        prefix_len = len(self.redis_config.pending_requests_prefix)
-        for key in keys:
-            catalog_id = key.decode('utf-8')[prefix_len:]
-            catalog_ids.add(catalog_id)
-
-        return catalog_ids
+        # Read the index instead of scanning the keyspace, first dropping
+        # catalogs whose pending requests have expired
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zremrangebyscore(self._index_key, "-inf", time.time())
+        pipe.zrange(self._index_key, 0, -1)
+        _, catalog_ids = await pipe.execute()
+
+        return {catalog_id.decode('utf-8') for catalog_id in catalog_ids}
@@ -1,7 +1,10 @@
+import asyncio
 import logging
-from typing import List
+from typing import BinaryIO, Dict, List, Optional
 
 import httpx
+from cachetools import TTLCache
+from fastapi.concurrency import run_in_threadpool
 
 from src.config import config
 from src.models import (
@@ -15,101 +18,162 @@ from src.services.token_service import TokenService
 
 logger = logging.getLogger(__name__)
 
+# Bounds concurrent requests to the Edge Service across all fan-outs
+edge_request_semaphore = asyncio.Semaphore(config.service.edge_request_concurrency)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create an HTTP client with a connection pool for outbound service calls."""
+    service_config = config.service
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=service_config.http_max_connections,
+            max_keepalive_connections=service_config.http_max_keepalive_connections
+        ),
+        timeout=service_config.http_timeout_seconds
+    )
+
+
+class PeerCache:
+    """Short-lived cache of Peer Registry lookups that also collapses concurrent misses."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.peers: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lookups: Dict[str, asyncio.Future] = {}
+
+
+def create_peer_cache() -> PeerCache:
+    """Create a peer cache sized from the service configuration."""
+    service_config = config.service
+    return PeerCache(
+        maxsize=service_config.peer_cache_size,
+        ttl=service_config.peer_cache_ttl_seconds
+    )
+
 
 class ScreenshotService:
     def __init__(self,
                  token_service: TokenService,
                  redis_service: RedisService,
                  kafka_service: KafkaService,
-                 storage_service: StorageService):
+                 storage_service: StorageService,
+                 http_client: Optional[httpx.AsyncClient] = None,
+                 peer_cache: Optional[PeerCache] = None):
         self.token_service = token_service
         self.redis_service = redis_service
         self.kafka_service = kafka_service
         self.storage_service = storage_service
         self.service_config = config.service
+        # Long-lived client so outbound calls reuse pooled connections
+        self.http_client = http_client if http_client is not None else create_http_client()
+        self.peer_cache = peer_cache if peer_cache is not None else create_peer_cache()
 
     async def handle_screenshot_request(self, request: ScreenshotRequest) -> None:
         """Handle a screenshot.requested event."""
-        logger.info(f"Handling screenshot request for catalog_id {request.catalog_id}")
+        logger.info("Handling screenshot request for catalog_id %s", request.catalog_id)
 
         # Store pending request
-        self.redis_service.add_pending_request(request)
+        await self.redis_service.add_pending_request(request)
 
         # Get peers with the requested catalog_id
         peers = await self._get_peers_with_catalog_id(request.catalog_id)
 
         if not peers:
-            logger.info(f"No peers found with catalog_id {request.catalog_id}")
+            logger.info("No peers found with catalog_id %s", request.catalog_id)
             return
 
-        # Request screenshots from peers
-        for peer in peers:
-            await self._request_screenshots_from_peer(peer, request)
+        # Request screenshots from peers concurrently; each call handles its own errors
+        await asyncio.gather(
+            *(self._request_screenshots_from_peer(peer, request) for peer in peers)
+        )
 
     async def handle_peer_available(self, peer: PeerWithMedia) -> None:
         """Handle a peer.available.with_requested_media event."""
-        logger.info(f"Handling peer available: {peer.peer_id} with {len(peer.catalog_ids)} catalog_ids")
+        logger.info("Handling peer available: %s with %d catalog_ids", peer.peer_id, len(peer.catalog_ids))
 
         # Check if any catalog_ids have pending requests
-        for catalog_id in peer.catalog_ids:
-            pending_requests = self.redis_service.get_pending_requests(catalog_id)
+        pending_by_catalog = await self.redis_service.get_pending_requests_bulk(peer.catalog_ids)
 
+        screenshot_requests = []
+        for catalog_id, pending_requests in pending_by_catalog.items():
             if not pending_requests:
                 continue
 
+            # Create a simplified PeerWithMedia with just one catalog_id
+            single_catalog_peer = PeerWithMedia(
+                peer_id=peer.peer_id,
+                edge_id=peer.edge_id,
+                catalog_ids=[catalog_id]
+            )
+
             # Request screenshots for each pending request
             for request in pending_requests:
-                # Create a simplified PeerWithMedia with just one catalog_id
-                single_catalog_peer = PeerWithMedia(
-                    peer_id=peer.peer_id,
-                    edge_id=peer.edge_id,
-                    catalog_ids=[catalog_id]
-                )
+                screenshot_requests.append(self._request_screenshots_from_peer(single_catalog_peer, request))
 
-                await self._request_screenshots_from_peer(single_catalog_peer, request)
+        await asyncio.gather(*screenshot_requests)
 
     async def _get_peers_with_catalog_id(self, catalog_id: str) -> List[PeerWithMedia]:
         """Get all peers that have a specific catalog_id."""
+        peers = self.peer_cache.peers.get(catalog_id)
+        if peers is not None:
+            return peers
+
+        # Share a single in-flight lookup between concurrent callers
+        lookup = self.peer_cache.lookups.get(catalog_id)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._fetch_peers_with_catalog_id(catalog_id))
+            self.peer_cache.lookups[catalog_id] = lookup
+            lookup.add_done_callback(lambda _: self.peer_cache.lookups.pop(catalog_id, None))
+
+        return await asyncio.shield(lookup)
+
+    async def _fetch_peers_with_catalog_id(self, catalog_id: str) -> List[PeerWithMedia]:
+        """Fetch peers that have a specific catalog_id from the Peer Registry."""
         try:
             # Make request to Peer Registry Service
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.service_config.peer_registry_url}/api/peers/catalog/{catalog_id}"
-                )
+            response = await self.http_client.get(
+                f"{self.service_config.peer_registry_url}/api/peers/catalog/{catalog_id}"
+            )
 
-                if response.status_code == 200:
-                    peers_data = response.json()
-                    return [PeerWithMedia(**peer) for peer in peers_data]
-                else:
-                    logger.error(f"Failed to get peers: {response.status_code} {response.text}")
-                    return []
+            if response.status_code == 200:
+                peers_data = response.json()
+                peers = [PeerWithMedia(**peer) for peer in peers_data]
+                self.peer_cache.peers[catalog_id] = peers
+                return peers
+            else:
+                logger.error("Failed to get peers: %s %s", response.status_code, response.text)
+                return []
         except Exception as e:
-            logger.error(f"Error getting peers: {e}")
+            logger.error("Error getting peers: %s", e)
             return []
 
     async def _request_screenshots_from_peer(self, peer: PeerWithMedia, request: ScreenshotRequest) -> None:
         """Request screenshots from a peer via the Edge Service."""
         try:
             # Create token for the peer
-            for catalog_id in peer.catalog_ids:
-                token_info = self.token_service.create_token(
+            token_infos = [
+                self.token_service.create_token(
                     peer_id=peer.peer_id,
                     catalog_id=catalog_id,
                     request_id=request.request_id
                 )
+                for catalog_id in peer.catalog_ids
+            ]
 
-                # Send request to Edge Service
-                await self._send_screenshot_request_to_edge(peer.edge_id, token_info)
+            # Send requests to Edge Service concurrently
+            await asyncio.gather(
+                *(self._send_screenshot_request_to_edge(peer.edge_id, token_info) for token_info in token_infos)
+            )
 
         except Exception as e:
-            logger.error(f"Error requesting screenshots: {e}")
+            logger.error("Error requesting screenshots: %s", e)
 
     async def _send_screenshot_request_to_edge(self, edge_id: str, token_info: ScreenshotTokenInfo) -> None:
         """Send a screenshot request to the Edge Service."""
         try:
             # Make request to Edge Service
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+            async with edge_request_semaphore:
+                response = await self.http_client.post(
                     f"{self.service_config.edge_service_url}/api/edge/{edge_id}/screenshot/request",
                     json={
                         "peer_id": token_info.peer_id,
@@ -119,48 +183,47 @@ class ScreenshotService:
                     }
                 )
 
-                if response.status_code != 202:
-                    logger.error(f"Failed to request screenshots: {response.status_code} {response.text}")
+            if response.status_code != 202:
+                logger.error("Failed to request screenshots: %s %s", response.status_code, response.text)
 
         except Exception as e:
-            logger.error(f"Error sending screenshot request: {e}")
+            logger.error("Error sending screenshot request: %s", e)
 
-    def process_screenshot_upload(self,
-                                  token_payload: TokenPayload,
-                                  screenshot_files: List[bytes],
-                                  content_types: List[str]) -> List[str]:
+    async def process_screenshot_upload(self,
+                                        token_payload: TokenPayload,
+                                        screenshot_files: List[BinaryIO],
+                                        content_types: List[str],
+                                        file_sizes: Optional[List[Optional[int]]] = None) -> List[str]:
         """Process screenshot upload from a peer."""
-        logger.info(f"Processing {len(screenshot_files)} screenshots for catalog_id {token_payload.catalog_id}")
+        logger.info("Processing %d screenshots for catalog_id %s", len(screenshot_files), token_payload.catalog_id)
 
         # Blacklist token to prevent reuse
-        self.token_service.blacklist_token(
+        await self.token_service.blacklist_token(
             token_payload.token_id,
             TokenBlacklistReason.ALREADY_USED
         )
 
-        # Upload screenshots to MinIO
-        screenshot_urls = []
-        for file_data, content_type in zip(screenshot_files, content_types):
-            try:
-                # Upload screenshot
-                object_name = self.storage_service.upload_screenshot(
-                    token_payload.catalog_id,
-                    file_data,
-                    content_type
-                )
-
-                # Get URL
-                url = self.storage_service.get_screenshot_url(object_name)
-                screenshot_urls.append(url)
+        # Upload screenshots to MinIO in worker threads, so the blocking
+        # client does not stall the event loop and files upload in parallel
+        results = await asyncio.gather(
+            *(run_in_threadpool(self._store_screenshot, token_payload.catalog_id, file_data, content_type, file_size)
+              for file_data, content_type, file_size in zip(
+                  screenshot_files, content_types, file_sizes or [None] * len(screenshot_files))),
+            return_exceptions=True
+        )
 
-            except Exception as e:
-                logger.error(f"Failed to upload screenshot: {e}")
+        screenshot_urls = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Failed to upload screenshot: %s", result)
+            else:
+                screenshot_urls.append(result)
 
         # Blacklist tokens for this catalog_id and request_id
-        self._blacklist_other_tokens(token_payload)
+        await self._blacklist_other_tokens(token_payload)
 
         # Remove pending request
-        self.redis_service.remove_pending_request(
+        await self.redis_service.remove_pending_request(
             token_payload.catalog_id,
             token_payload.request_id
         )
@@ -174,27 +237,23 @@ class ScreenshotService:
 
         return screenshot_urls
 
-    def _blacklist_other_tokens(self, token_payload: TokenPayload) -> None:
+    def _store_screenshot(self, catalog_id: str, file_data: BinaryIO, content_type: str,
+                          file_size: Optional[int]) -> str:
+        """Upload a screenshot and return its URL."""
+        object_name = self.storage_service.upload_screenshot(catalog_id, file_data, content_type, length=file_size)
+        return self.storage_service.get_screenshot_url(object_name)
+
+    async def _blacklist_other_tokens(self, token_payload: TokenPayload) -> None:
         """Blacklist tokens for other peers for the same request."""
-        # Get peers with the catalog_id (using synchronous client for simplicity)
+        # Get peers with the catalog_id, sharing the lookup made when the request was sent
         try:
-            with httpx.Client() as client:
-                response = client.get(
-                    f"{self.service_config.peer_registry_url}/api/peers/catalog/{token_payload.catalog_id}"
-                )
-
-                if response.status_code != 200:
-                    logger.error(f"Failed to get peers: {response.status_code} {response.text}")
-                    return
-
-                peers_data = response.json()
-
-                # Blacklist tokens for other peers (implementation simplified)
-                for peer_data in peers_data:
-                    peer = PeerWithMedia(**peer_data)
-                    if peer.peer_id != token_payload.peer_id:
-                        logger.info(f"Blacklisting token for peer {peer.peer_id}")
-                        # Here we would request token_id from Edge Service and blacklist it
-                        # Simplified for brevity
+            peers = await self._get_peers_with_catalog_id(token_payload.catalog_id)
+
+            # Blacklist tokens for other peers (implementation simplified)
+            for peer in peers:
+                if peer.peer_id != token_payload.peer_id:
+                    logger.info("Blacklisting token for peer %s", peer.peer_id)
+                    # Here we would request token_id from Edge Service and blacklist it
+                    # Simplified for brevity
         except Exception as e:
-            logger.error(f"Error blacklisting other tokens: {e}")
+            logger.error("Error blacklisting other tokens: %s", e)
@@ -1,58 +1,162 @@
+import importlib
 import io
-import uuid
-from typing import BinaryIO
+import logging
+import os
+import secrets
+import threading
+from datetime import timedelta
+from typing import BinaryIO, Optional, Set, Tuple
 
+import certifi
+import urllib3
 from minio import Minio
 from minio.error import S3Error
 
 from src.config import config
 
+logger = logging.getLogger(__name__)
+
+# Content types that are always transcoded to JPEG when recompression is enabled
+RECOMPRESS_CONTENT_TYPES = {"image/png", "image/bmp"}
+
+# Validity of presigned screenshot URLs
+SCREENSHOT_URL_EXPIRES = timedelta(hours=1)
+
+
+def create_minio_http_client() -> urllib3.PoolManager:
+    """Create a connection pool for MinIO sized for concurrent uploads."""
+    # Same timeouts, retries and CA handling as the MinIO client's default pool
+    timeout = timedelta(minutes=5).seconds
+    return urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=timeout, read=timeout),
+        maxsize=config.minio.max_connections,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=urllib3.Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504]
+        )
+    )
+
 
 class StorageService:
+    # (endpoint, bucket) pairs already known to exist, so later instances skip the check
+    _checked_buckets: Set[Tuple[str, str]] = set()
+    _checked_buckets_lock = threading.Lock()
+
     def __init__(self):
         minio_config = config.minio
         self.client = Minio(
             minio_config.endpoint,
             access_key=minio_config.access_key,
             secret_key=minio_config.secret_key,
-            secure=minio_config.secure
+            secure=minio_config.secure,
+            http_client=create_minio_http_client()
         )
         self.bucket_name = minio_config.bucket_name
-        self._ensure_bucket_exists()
+        self.part_size = minio_config.part_size
+        self.num_parallel_uploads = minio_config.num_parallel_uploads
+        self.recompress_on_upload = minio_config.recompress_on_upload
+        self.recompress_quality = minio_config.recompress_quality
+        self.recompress_min_jpeg_size = minio_config.recompress_min_jpeg_size
+        if self.recompress_on_upload:
+            self._ensure_pillow_installed()
+        self._ensure_bucket_exists(minio_config.endpoint)
 
-    def _ensure_bucket_exists(self) -> None:
-        """Ensure the screenshots bucket exists."""
+    @staticmethod
+    def _ensure_pillow_installed() -> None:
+        """Fail at startup rather than on every upload when recompression cannot run."""
         try:
-            if not self.client.bucket_exists(self.bucket_name):
-                self.client.make_bucket(self.bucket_name)
-        except S3Error as e:
-            raise RuntimeError(f"Failed to create bucket: {e}")
+            importlib.import_module("PIL.Image")
+        except ImportError:
+            raise RuntimeError("MINIO_RECOMPRESS_ON_UPLOAD requires Pillow; install the recompress extra")
+
+    def _ensure_bucket_exists(self, endpoint: str) -> None:
+        """Ensure the screenshots bucket exists, checking once per process."""
+        bucket_key = (endpoint, self.bucket_name)
+        with StorageService._checked_buckets_lock:
+            if bucket_key in StorageService._checked_buckets:
+                return
+
+            try:
+                if not self.client.bucket_exists(self.bucket_name):
+                    self.client.make_bucket(self.bucket_name)
+            except S3Error as e:
+                raise RuntimeError(f"Failed to create bucket: {e}")
+
+            StorageService._checked_buckets.add(bucket_key)
 
-    def upload_screenshot(self, catalog_id: str, file_data: BinaryIO, content_type: str) -> str:
-        """Upload a screenshot file to MinIO."""
+    def upload_screenshot(self, catalog_id: str, file_data: BinaryIO, content_type: str,
+                          length: Optional[int] = None) -> str:
+        """Upload a screenshot file to MinIO, using its length when the caller knows it."""
         try:
+            if length is None:
+                length = self._remaining_length(file_data)
+
+            # Shrink lossless or oversized screenshots before they are stored and served
+            if self.recompress_on_upload and (
+                    content_type in RECOMPRESS_CONTENT_TYPES
+                    or (content_type == "image/jpeg" and length is not None
+                        and length > self.recompress_min_jpeg_size)):
+                file_data, length, content_type = self._recompress_jpeg(file_data, content_type)
+
             # Generate unique object name
-            file_id = str(uuid.uuid4())
+            file_id = secrets.token_hex(16)
             object_name = f"{catalog_id}/{file_id}.jpg"
 
-            # Get file size
-            file_data.seek(0, io.SEEK_END)
-            file_size = file_data.tell()
-            file_data.seek(0)
-
-            # Upload file
+            # Stream file without measuring it first, so memory use stays
+            # bounded by the part size; files up to the part size go in a single PUT
             self.client.put_object(
                 bucket_name=self.bucket_name,
                 object_name=object_name,
                 data=file_data,
-                length=file_size,
-                content_type=content_type
+                length=-1 if length is None else length,
+                part_size=self.part_size,
+                content_type=content_type,
+                num_parallel_uploads=self.num_parallel_uploads
             )
 
             return object_name
         except S3Error as e:
             raise RuntimeError(f"Failed to upload screenshot: {e}")
 
+    def _recompress_jpeg(self, file_data: BinaryIO, content_type: str) -> Tuple[BinaryIO, int, str]:
+        """Re-encode an image as JPEG, keeping the original if that is not smaller."""
+        # Optional dependency, only needed when recompression is enabled
+        from PIL import Image
+
+        raw = file_data.read()
+        try:
+            with Image.open(io.BytesIO(raw)) as image:
+                output = io.BytesIO()
+                image.convert("RGB").save(output, format="JPEG", quality=self.recompress_quality)
+        except (Image.DecompressionBombError, OSError, ValueError) as e:
+            logger.warning(f"Failed to recompress screenshot, storing original: {e}")
+            return io.BytesIO(raw), len(raw), content_type
+
+        if content_type == "image/jpeg" and output.tell() >= len(raw):
+            return io.BytesIO(raw), len(raw), content_type
+
+        length = output.tell()
+        output.seek(0)
+        return output, length, "image/jpeg"
+
+    @staticmethod
+    def _remaining_length(file_data: BinaryIO) -> Optional[int]:
+        """Get the unread length of a stream if it is known without reading or seeking."""
+        if isinstance(file_data, io.BytesIO):
+            return file_data.getbuffer().nbytes - file_data.tell()
+
+        # Only plain files; fileno() on a spooled file would force it to disk
+        if isinstance(file_data, (io.FileIO, io.BufferedReader, io.BufferedRandom)):
+            try:
+                return os.fstat(file_data.fileno()).st_size - file_data.tell()
+            except OSError:
+                return None
+
+        return None
+
     def get_screenshot_url(self, object_name: str) -> str:
         """Get presigned URL for a screenshot."""
         try:
@@ -60,7 +164,7 @@ class StorageService:
             url = self.client.presigned_get_object(
                 bucket_name=self.bucket_name,
                 object_name=object_name,
-                expires=3600
+                expires=SCREENSHOT_URL_EXPIRES
             )
             return url
         except S3Error as e:
@@ -1,12 +1,33 @@
-import uuid
-from datetime import datetime, timedelta
-from typing import Optional, Dict
-
-from jose import jwt
-from redis import Redis
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from datetime import datetime
+from typing import Any, Optional, Dict
+
+import jwt
+import orjson
+from cachetools import TTLCache
+from redis.asyncio import Redis
 
 from src.config import config
-from src.models import TokenPayload, ScreenshotTokenInfo, TokenBlacklistReason
+from src.models import TokenPayload, ScreenshotTokenInfo, TokenBlacklistReason, TokenValidationResult
+
+# Claims every upload token must carry
+TOKEN_CLAIMS = ("peer_id", "catalog_id", "request_id", "token_id", "exp")
+
+# Blacklist reasons as stored in Redis, in both directions
+BLACKLIST_REASON_VALUES = {reason: reason.value.encode('utf-8') for reason in TokenBlacklistReason}
+BLACKLIST_REASONS = {value: reason for reason, value in BLACKLIST_REASON_VALUES.items()}
+
+# Digests for the HMAC algorithms that can be signed without PyJWT
+HMAC_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+
+def _b64url(data: bytes) -> bytes:
+    """Base64url-encode without padding, as used in JWT segments."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
 
 
 class TokenService:
@@ -14,30 +35,55 @@ class TokenService:
         self.redis_client = redis_client
         self.jwt_config = config.jwt
         self.redis_config = config.redis
+        # Key prefix encoded once; bytes keys and values bypass redis-py's encoder
+        self._blacklist_prefix = self.redis_config.token_blacklist_prefix.encode('utf-8')
+        # Verified token payloads keyed by token digest, so repeated uploads
+        # with the same bearer token skip signature verification
+        self.validation_cache = TTLCache(
+            maxsize=self.jwt_config.validation_cache_size,
+            ttl=self.jwt_config.validation_cache_ttl_seconds
+        )
+        # Blacklist reasons keyed by token_id; only positive results are kept,
+        # since a blacklisted token never becomes valid again but a valid one
+        # may be blacklisted by another process at any time
+        self.blacklist_cache = TTLCache(
+            maxsize=self.jwt_config.blacklist_cache_size,
+            ttl=self.jwt_config.blacklist_cache_ttl_seconds
+        )
+        # Decode arguments are fixed for the lifetime of the service; required
+        # claims are checked by the decoder, so malformed tokens are rejected
+        # like any other invalid token
+        self._decode_kwargs = {
+            "key": self.jwt_config.secret_key,
+            "algorithms": [self.jwt_config.algorithm],
+            "options": {"verify_aud": False, "require": list(TOKEN_CLAIMS)}
+        }
+        # HMAC keyed once and copied per token, instead of re-running the key
+        # schedule on every signature; verification always goes through PyJWT
+        digestmod = HMAC_DIGESTS.get(self.jwt_config.algorithm)
+        self._hmac_template = None
+        if self.jwt_config.fast_signing and digestmod is not None:
+            self._hmac_template = hmac.new(self.jwt_config.secret_key.encode('utf-8'), digestmod=digestmod)
+            self._header_segment = _b64url(orjson.dumps({"alg": self.jwt_config.algorithm, "typ": "JWT"}))
 
     def create_token(self, peer_id: str, catalog_id: str, request_id: str) -> ScreenshotTokenInfo:
         """Create a one-time JWT token for screenshot upload."""
-        token_id = str(uuid.uuid4())
+        token_id = secrets.token_hex(16)
 
-        # Set expiration time
-        expires_delta = timedelta(minutes=self.jwt_config.token_expire_minutes)
-        expire = datetime.utcnow() + expires_delta
+        # Set expiration time as epoch seconds
+        expire = time.time() + self.jwt_config.token_expire_minutes * 60
 
         # Create token payload
-        to_encode: Dict[str, str] = {
+        to_encode: Dict[str, Any] = {
             "peer_id": peer_id,
             "catalog_id": catalog_id,
             "request_id": request_id,
             "token_id": token_id,
-            "exp": expire.timestamp()
+            "exp": expire
         }
 
         # Encode JWT
-        encoded_jwt = jwt.encode(
-            to_encode,
-            self.jwt_config.secret_key,
-            algorithm=self.jwt_config.algorithm
-        )
+        encoded_jwt = self._encode_token(to_encode)
 
         return ScreenshotTokenInfo(
             token=encoded_jwt,
@@ -47,16 +93,44 @@ class TokenService:
             token_id=token_id
         )
 
-    def validate_token(self, token: str) -> Optional[TokenPayload]:
-        """Validate a token and return its payload if valid."""
-        try:
-            # Decode JWT
-            payload = jwt.decode(
-                token,
+    def _encode_token(self, claims: Dict[str, Any]) -> str:
+        """Sign claims into a JWT."""
+        if self._hmac_template is None:
+            return jwt.encode(
+                claims,
                 self.jwt_config.secret_key,
-                algorithms=[self.jwt_config.algorithm]
+                algorithm=self.jwt_config.algorithm
             )
 
+        signing_input = self._header_segment + b"." + _b64url(orjson.dumps(claims))
+        mac = self._hmac_template.copy()
+        mac.update(signing_input)
+        return (signing_input + b"." + _b64url(mac.digest())).decode('ascii')
+
+    async def validate_token(self, token: str) -> TokenValidationResult:
+        """Validate a token, returning its payload if valid or why it was rejected."""
+        cache_key = hashlib.sha256(token.encode('utf-8')).digest()[:16]
+
+        # Reuse a previously verified payload until the token itself expires
+        token_data = self.validation_cache.get(cache_key)
+        if token_data is None or token_data.exp <= datetime.now():
+            # Peek at the claims first, so replayed or expired tokens are
+            # rejected without verifying the signature
+            claims = self._peek_claims(token)
+            token_id = token_data.token_id if token_data else claims.get("token_id")
+            if not isinstance(token_id, str):
+                token_id = None
+
+            exp = claims.get("exp")
+            if token_id in self.blacklist_cache or (isinstance(exp, (int, float)) and exp <= time.time()):
+                return await self._reject_token(cache_key, token_id)
+
+            try:
+                # Decode JWT
+                payload = jwt.decode(token, **self._decode_kwargs)
+            except jwt.PyJWTError:
+                return await self._reject_token(cache_key, token_id)
+
             # Create payload model
             token_data = TokenPayload(
                 peer_id=payload["peer_id"],
@@ -65,31 +139,62 @@ class TokenService:
                 token_id=payload["token_id"],
                 exp=datetime.fromtimestamp(payload["exp"])
             )
+            self.validation_cache[cache_key] = token_data
 
-            # Check if token is blacklisted
-            blacklist_key = f"{self.redis_config.token_blacklist_prefix}{token_data.token_id}"
-            if self.redis_client.exists(blacklist_key):
-                return None
+        # Check if token is blacklisted; always consulted so one-time tokens
+        # stay one-time across processes even when the payload is cached
+        reason = await self.get_blacklist_reason(token_data.token_id)
+        if reason is not None:
+            return TokenValidationResult(token_id=token_data.token_id, reason=reason)
 
-            return token_data
-        except jwt.JWTError:
-            return None
+        return TokenValidationResult(payload=token_data, token_id=token_data.token_id)
+
+    async def _reject_token(self, cache_key: bytes, token_id: Optional[str]) -> TokenValidationResult:
+        """Drop a rejected token from the cache and look up why it may have been blacklisted."""
+        self.validation_cache.pop(cache_key, None)
+
+        # A rejected token may still have been blacklisted, e.g. used and then expired
+        reason = await self.get_blacklist_reason(token_id) if token_id else None
+        return TokenValidationResult(token_id=token_id, reason=reason)
 
-    def blacklist_token(self, token_id: str, reason: TokenBlacklistReason, ttl_hours: int = 24) -> None:
+    @staticmethod
+    def _peek_claims(token: str) -> Dict[str, Any]:
+        """Read the claims segment without verifying the token."""
+        try:
+            claims_b64 = token.split(".", 2)[1]
+            claims = orjson.loads(base64.urlsafe_b64decode(claims_b64 + "=" * (-len(claims_b64) % 4)))
+        except (IndexError, ValueError):
+            return {}
+
+        return claims if isinstance(claims, dict) else {}
+
+    def _blacklist_key(self, token_id: str) -> bytes:
+        """Build the Redis key for a blacklisted token."""
+        return self._blacklist_prefix + token_id.encode('utf-8')
+
+    async def blacklist_token(self, token_id: str, reason: TokenBlacklistReason, ttl_hours: int = 24) -> None:
         """Blacklist a token."""
-        blacklist_key = f"{self.redis_config.token_blacklist_prefix}{token_id}"
-        self.redis_client.setex(
+        blacklist_key = self._blacklist_key(token_id)
+        await self.redis_client.setex(
             blacklist_key,
-            timedelta(hours=ttl_hours),
-            reason.value
+            ttl_hours * 3600,
+            BLACKLIST_REASON_VALUES[reason]
         )
+        self.blacklist_cache[token_id] = reason
 
-    def get_blacklist_reason(self, token_id: str) -> Optional[TokenBlacklistReason]:
+    async def get_blacklist_reason(self, token_id: str) -> Optional[TokenBlacklistReason]:
         """Get the reason a token was blacklisted."""
-        blacklist_key = f"{self.redis_config.token_blacklist_prefix}{token_id}"
-        reason_value = self.redis_client.get(blacklist_key)
+        reason = self.blacklist_cache.get(token_id)
+        if reason is not None:
+            return reason
+
+        blacklist_key = self._blacklist_key(token_id)
+        reason_value = await self.redis_client.get(blacklist_key)
 
         if not reason_value:
             return None
 
-        return TokenBlacklistReason(reason_value.decode('utf-8'))
+        # Map the stored bytes straight to the reason, without decoding
+        reason = BLACKLIST_REASONS[reason_value]
+        self.blacklist_cache[token_id] = reason
+        return reason
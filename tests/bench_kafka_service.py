@@ -0,0 +1,82 @@
+"""Throughput benchmark for the Kafka consume loop.
+
+Run with ``python -m tests.bench_kafka_service``. Not collected by pytest.
+"""
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from src.models import ScreenshotRequest
+from src.services.kafka_service import KafkaService
+
+# Messages returned per consume call and number of batches
+BATCH_SIZE = 500
+BATCHES = 200
+
+
+class FakeMessage:
+    """Kafka message stub without MagicMock's attribute machinery."""
+    __slots__ = ("_topic", "_value", "_error")
+
+    def __init__(self, topic: str, value: bytes, error=None):
+        self._topic = topic
+        self._value = value
+        self._error = error
+
+    def topic(self) -> str:
+        return self._topic
+
+    def value(self) -> bytes:
+        return self._value
+
+    def error(self):
+        return self._error
+
+
+class FakeConsumer:
+    """Consumer stub returning the same batch a fixed number of times."""
+
+    def __init__(self, service: KafkaService, batch, batches: int):
+        self._service = service
+        self._batch = batch
+        self._remaining = batches
+
+    def consume(self, num_messages: int, timeout: float):
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self._service.running = False
+        return self._batch
+
+    def close(self) -> None:
+        pass
+
+
+def main() -> None:
+    with patch("src.services.kafka_service.Producer"):
+        service = KafkaService()
+
+    # Build one batch of screenshot requests
+    now = datetime.now()
+    value = ScreenshotRequest(
+        catalog_id="bench-catalog",
+        request_id="bench-request",
+        requester_service="bench",
+        created_at=now,
+        expires_at=now + timedelta(hours=24),
+    ).model_dump_json().encode("utf-8")
+    batch = [FakeMessage(service.kafka_config.screenshots_requested_topic, value) for _ in range(BATCH_SIZE)]
+
+    service.consumer = FakeConsumer(service, batch, BATCHES)
+    service.running = True
+
+    # Time the loop with no-op handlers
+    start = time.perf_counter()
+    service._consume_loop(lambda request: None, lambda peer: None)
+    elapsed = time.perf_counter() - start
+
+    total = BATCH_SIZE * BATCHES
+    print(f"{total} messages in {elapsed:.3f}s ({total / elapsed:,.0f} msg/s)")
+
+
+if __name__ == "__main__":
+    main()
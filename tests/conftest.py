@@ -2,29 +2,49 @@ import io
 from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import jwt
 import pytest
+import uvloop
 from fastapi.testclient import TestClient
-from jose import jwt
 from minio import Minio
-from redis import Redis
+from redis.asyncio import Redis
 
 import src.main
+from src.config import config
 from src.models import (
     PeerWithMedia,
     ScreenshotRequest,
     ScreenshotTokenInfo,
     TokenPayload,
+    TokenValidationResult,
 )
 from src.services.kafka_service import KafkaService
 from src.services.redis_service import RedisService
 from src.services.screenshot_service import ScreenshotService
 from src.services.storage_service import StorageService
 from src.services.token_service import TokenService
+from tests.fakes import (
+    FakeJwtEncoder,
+    FakeKafkaService,
+    FakeRedisService,
+    FakeResponse,
+    FakeStorageService,
+    FakeTokenService,
+    MockS3Error,
+)
+
+
+# ====== Event Loop Fixtures ======
+
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Run async tests on uvloop, as the server does."""
+    return uvloop.EventLoopPolicy()
 
 
 # ====== Test Data Fixtures ======
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_data():
     """Central fixture providing test data constants used across tests."""
     return {
@@ -41,9 +61,9 @@ def test_data():
     }
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_token_payload(test_data):
-    """Create a sample TokenPayload for testing."""
+    """Create a sample TokenPayload for testing, shared since the model is frozen."""
     return TokenPayload(
         peer_id=test_data["peer_id"],
         catalog_id=test_data["catalog_id"],
@@ -53,9 +73,21 @@ def sample_token_payload(test_data):
     )
 
 
+@pytest.fixture(scope="session")
+def decoded_payload(sample_token_payload):
+    """Create the claims jwt.decode yields for the sample token, shared since the service only reads them."""
+    return {
+        "peer_id": sample_token_payload.peer_id,
+        "catalog_id": sample_token_payload.catalog_id,
+        "request_id": sample_token_payload.request_id,
+        "token_id": sample_token_payload.token_id,
+        "exp": sample_token_payload.exp.timestamp(),
+    }
+
+
 @pytest.fixture
 def sample_screenshot_request(test_data):
-    """Create a sample ScreenshotRequest for testing."""
+    """Create a sample ScreenshotRequest for testing, per test since tests change its times."""
     return ScreenshotRequest(
         catalog_id=test_data["catalog_id"],
         request_id=test_data["request_id"],
@@ -65,9 +97,9 @@ def sample_screenshot_request(test_data):
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_peer_with_media(test_data):
-    """Create a sample PeerWithMedia for testing."""
+    """Create a sample PeerWithMedia for testing, shared since the model is frozen."""
     return PeerWithMedia(
         peer_id=test_data["peer_id"],
         edge_id=test_data["edge_id"],
@@ -75,9 +107,15 @@ def sample_peer_with_media(test_data):
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def sample_peer_dump(sample_peer_with_media):
+    """Peer Registry JSON for the sample peer, dumped once."""
+    return sample_peer_with_media.model_dump()
+
+
+@pytest.fixture(scope="session")
 def sample_token_info(test_data):
-    """Create a sample ScreenshotTokenInfo for testing."""
+    """Create a sample ScreenshotTokenInfo for testing, shared since the model is frozen."""
     encoded_jwt = jwt.encode(
         {
             "peer_id": test_data["peer_id"],
@@ -101,14 +139,14 @@ def sample_token_info(test_data):
 
 @pytest.fixture
 def sample_screenshot_files():
-    """Create sample screenshot binary data for testing."""
+    """Create sample screenshot binary data for testing, per test since reads move the streams."""
     return [
         io.BytesIO(b"fake-screenshot-data-1"),
         io.BytesIO(b"fake-screenshot-data-2"),
     ]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_content_types():
     """Create sample content types for testing."""
     return ["image/jpeg", "image/jpeg"]
@@ -116,18 +154,30 @@ def sample_content_types():
 
 # ====== Mock Service Fixtures ======
 
+# Attribute names for client mocks, introspected once rather than per test
+REDIS_SPEC = dir(Redis)
+MINIO_SPEC = dir(Minio)
+
+
 @pytest.fixture
 def mock_redis():
     """Mock Redis client."""
-    redis_mock = MagicMock(spec=Redis)
+    redis_mock = MagicMock(spec=REDIS_SPEC)
 
     # Common Redis mocked behaviors
-    redis_mock.hgetall.return_value = {}
-    redis_mock.exists.return_value = False
-    redis_mock.setex.return_value = True
-    redis_mock.hset.return_value = 1
-    redis_mock.hdel.return_value = 1
-    redis_mock.get.return_value = None
+    redis_mock.hgetall = AsyncMock(return_value={})
+    redis_mock.hvals = AsyncMock(return_value=[])
+    redis_mock.exists = AsyncMock(return_value=False)
+    redis_mock.setex = AsyncMock(return_value=True)
+    redis_mock.hset = AsyncMock(return_value=1)
+    redis_mock.hdel = AsyncMock(return_value=1)
+    redis_mock.get = AsyncMock(return_value=None)
+    redis_mock.register_script.return_value = AsyncMock(return_value=None)
+
+    # Pipelines buffer commands and only await execute
+    pipe_mock = MagicMock()
+    pipe_mock.execute = AsyncMock(return_value=[])
+    redis_mock.pipeline.return_value = pipe_mock
 
     return redis_mock
 
@@ -145,7 +195,7 @@ def mock_producer():
 def mock_consumer():
     """Mock Kafka Consumer."""
     consumer_mock = MagicMock()
-    consumer_mock.poll.return_value = None
+    consumer_mock.consume.return_value = []
     consumer_mock.subscribe.return_value = None
     consumer_mock.close.return_value = None
     return consumer_mock
@@ -154,7 +204,7 @@ def mock_consumer():
 @pytest.fixture
 def mock_minio_client():
     """Mock MinIO client."""
-    minio_mock = MagicMock(spec=Minio)
+    minio_mock = MagicMock(spec=MINIO_SPEC)
     minio_mock.bucket_exists.return_value = True
     minio_mock.make_bucket.return_value = None
     minio_mock.put_object.return_value = None
@@ -165,25 +215,34 @@ def mock_minio_client():
 # ====== Service Fixtures ======
 
 @pytest.fixture
-def token_service(mock_redis, test_data):
-    """Create a TokenService with controlled behavior."""
-    with patch("src.services.token_service.jwt") as jwt_mock:
-        jwt_mock.encode.return_value = "mocked-jwt-token"
-        jwt_mock.decode.return_value = {
-            "peer_id": test_data["peer_id"],
-            "catalog_id": test_data["catalog_id"],
-            "request_id": test_data["request_id"],
-            "token_id": test_data["token_id"],
-            "exp": (datetime.now() + timedelta(minutes=30)).timestamp(),
-        }
+def jwt_config(monkeypatch, test_data):
+    """Point the JWT config at the test secret, restored after each test."""
+    monkeypatch.setattr(config.jwt, "secret_key", test_data["jwt_secret"])
+    monkeypatch.setattr(config.jwt, "algorithm", "HS256")
+    monkeypatch.setattr(config.jwt, "token_expire_minutes", 30)
+    return config.jwt
 
-        service = TokenService(mock_redis)
-        # Override config for testing
-        service.jwt_config.secret_key = test_data["jwt_secret"]
-        service.jwt_config.algorithm = "HS256"
-        service.jwt_config.token_expire_minutes = 30
 
-        return service
+@pytest.fixture
+def token_service(mock_redis, jwt_config):
+    """Create a TokenService with controlled behavior, per test since its caches hold state."""
+    return TokenService(mock_redis)
+
+
+@pytest.fixture
+def patched_jwt_encode(monkeypatch):
+    """Patch jwt.encode to record its arguments and return a fixed token."""
+    encoder = FakeJwtEncoder()
+    monkeypatch.setattr("src.services.token_service.jwt.encode", encoder)
+    return encoder
+
+
+@pytest.fixture
+def patched_jwt_decode(monkeypatch, decoded_payload):
+    """Patch jwt.decode to return the claims of the sample token payload."""
+    decode_mock = MagicMock(return_value=decoded_payload)
+    monkeypatch.setattr("src.services.token_service.jwt.decode", decode_mock)
+    return decode_mock
 
 
 @pytest.fixture
@@ -203,22 +262,28 @@ def kafka_service(mock_producer, mock_consumer):
 
 
 @pytest.fixture
-def storage_service(mock_minio_client):
+def patched_minio(monkeypatch, mock_minio_client):
+    """Make StorageService build the mocked MinIO client and catch MockS3Error."""
+    monkeypatch.setattr("src.services.storage_service.Minio", lambda *args, **kwargs: mock_minio_client)
+    monkeypatch.setattr("src.services.storage_service.S3Error", MockS3Error)
+    return mock_minio_client
+
+
+@pytest.fixture
+def storage_service(patched_minio):
     """Create a StorageService with mocked MinIO client."""
-    with patch("src.services.storage_service.Minio", return_value=mock_minio_client):
-        service = StorageService()
-        service.client = mock_minio_client
-        return service
+    return StorageService()
 
 
 @pytest.fixture
-def screenshot_service(token_service, redis_service, kafka_service, storage_service):
-    """Create a ScreenshotService with mocked dependencies."""
+def screenshot_service(mock_httpx_client):
+    """Create a ScreenshotService with fake service dependencies."""
     return ScreenshotService(
-        token_service=token_service,
-        redis_service=redis_service,
-        kafka_service=kafka_service,
-        storage_service=storage_service,
+        token_service=FakeTokenService(),
+        redis_service=FakeRedisService(),
+        kafka_service=FakeKafkaService(),
+        storage_service=FakeStorageService(),
+        http_client=mock_httpx_client,
     )
 
 
@@ -227,11 +292,7 @@ def screenshot_service(token_service, redis_service, kafka_service, storage_serv
 @pytest.fixture
 def mock_httpx_response():
     """Create a mock httpx response."""
-    response = MagicMock()
-    response.status_code = 200
-    response.json.return_value = []
-    response.text = "{}"
-    return response
+    return FakeResponse(status_code=200, text="{}", json_data=[])
 
 
 @pytest.fixture
@@ -252,17 +313,20 @@ def app_with_mocked_deps():
     # Override dependencies
     @app.dependency_overrides[src.dependencies.get_redis_client]
     def mock_get_redis_client():
-        return MagicMock(spec=Redis)
+        return MagicMock(spec=REDIS_SPEC)
 
     @app.dependency_overrides[src.dependencies.get_token_service]
     def mock_get_token_service():
         mock = MagicMock(spec=TokenService)
-        mock.validate_token.return_value = TokenPayload(
-            peer_id="test-peer-id",
-            catalog_id="test-catalog-id",
-            request_id="test-request-id",
+        mock.validate_token.return_value = TokenValidationResult(
+            payload=TokenPayload(
+                peer_id="test-peer-id",
+                catalog_id="test-catalog-id",
+                request_id="test-request-id",
+                token_id="test-token-id",
+                exp=datetime.now() + timedelta(minutes=30),
+            ),
             token_id="test-token-id",
-            exp=datetime.now() + timedelta(minutes=30),
         )
         return mock
 
@@ -0,0 +1,120 @@
+"""Lightweight fakes and helpers shared by the tests.
+
+Plain classes that record their calls, so tests avoid building MagicMock specs.
+"""
+from typing import Any, BinaryIO, Dict, List, Optional, Set
+
+import pytest
+
+from src.models import ScreenshotRequest, ScreenshotTokenInfo, TokenBlacklistReason
+
+
+def log_messages(caplog: pytest.LogCaptureFixture, level: int) -> List[str]:
+    """Get the messages captured at exactly the given level."""
+    return [record.getMessage() for record in caplog.records if record.levelno == level]
+
+
+class MockS3Error(Exception):
+    """Stand-in for S3Error, which cannot be raised without a response."""
+
+    def __init__(self, message="Mocked S3 Error"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class FakeClock:
+    """Stand-in for the time module that always reports the same epoch time."""
+    __slots__ = ("now",)
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+class FakeResponse:
+    """Minimal httpx response with just the attributes the services read."""
+    __slots__ = ("status_code", "text", "json_data")
+
+    def __init__(self, status_code: int = 200, text: str = "", json_data: Any = None):
+        self.status_code = status_code
+        self.text = text
+        self.json_data = json_data
+
+    def json(self) -> Any:
+        return self.json_data
+
+
+class FakeJwtEncoder:
+    """Stand-in for jwt.encode that records its arguments and returns a fixed token."""
+
+    def __init__(self, token: str = "mocked-jwt-token"):
+        self.token = token
+        self.calls = []
+
+    def __call__(self, payload: Dict[str, Any], key: str, algorithm: str) -> str:
+        self.calls.append((payload, key, algorithm))
+        return self.token
+
+
+class FakeTokenService:
+    def __init__(self):
+        self.token_info: Optional[ScreenshotTokenInfo] = None
+        self.create_token_error: Optional[Exception] = None
+        self.created_tokens = []
+        self.blacklisted_tokens = []
+
+    def create_token(self, peer_id: str, catalog_id: str, request_id: str) -> ScreenshotTokenInfo:
+        self.created_tokens.append((peer_id, catalog_id, request_id))
+        if self.create_token_error is not None:
+            raise self.create_token_error
+        return self.token_info
+
+    async def blacklist_token(self, token_id: str, reason: TokenBlacklistReason, ttl_hours: int = 24) -> None:
+        self.blacklisted_tokens.append((token_id, reason))
+
+
+class FakeRedisService:
+    def __init__(self):
+        self.pending_requests: Dict[str, List[ScreenshotRequest]] = {}
+        self.added_requests = []
+        self.bulk_lookups = []
+        self.removed_requests = []
+
+    async def add_pending_request(self, request: ScreenshotRequest) -> None:
+        self.added_requests.append(request)
+
+    async def get_pending_requests_bulk(self, catalog_ids: List[str]) -> Dict[str, List[ScreenshotRequest]]:
+        self.bulk_lookups.append(catalog_ids)
+        return {catalog_id: self.pending_requests.get(catalog_id, []) for catalog_id in catalog_ids}
+
+    async def remove_pending_request(self, catalog_id: str, request_id: str) -> None:
+        self.removed_requests.append((catalog_id, request_id))
+
+
+class FakeKafkaService:
+    def __init__(self):
+        self.completed_events = []
+
+    def publish_screenshots_completed(self, catalog_id: str, request_id: str,
+                                      screenshot_urls: List[str]) -> None:
+        self.completed_events.append((catalog_id, request_id, screenshot_urls))
+
+
+class FakeStorageService:
+    # Uploads run in worker threads; list.append is atomic, so no lock is needed
+    def __init__(self):
+        self.object_names: Dict[BinaryIO, str] = {}
+        self.failing_files: Set[BinaryIO] = set()
+        self.uploads = []
+
+    def upload_screenshot(self, catalog_id: str, file_data: BinaryIO, content_type: str,
+                          length: Optional[int] = None) -> str:
+        self.uploads.append((catalog_id, file_data, content_type, length))
+        if file_data in self.failing_files:
+            raise RuntimeError("Failed to upload screenshot")
+        return self.object_names.get(file_data, "uploaded.jpg")
+
+    def get_screenshot_url(self, object_name: str) -> str:
+        return f"https://minio/{object_name}"
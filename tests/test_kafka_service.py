@@ -1,10 +1,16 @@
-import json
 from unittest.mock import MagicMock, patch
 
+import orjson
 import pytest
 from confluent_kafka import KafkaError, KafkaException
 
 from src.models import PeerWithMedia, ScreenshotRequest
+from src.services.kafka_service import (
+    CONSUME_BATCH_SIZE,
+    CONSUME_TIMEOUT,
+    PRODUCE_RETRY_ATTEMPTS,
+    KafkaService,
+)
 
 
 @pytest.mark.unit
@@ -19,6 +25,25 @@ class TestKafkaService:
         assert kafka_service.running is False
         assert kafka_service.consumer_thread is None
 
+    def test_init_producer_compression(self, mock_producer):
+        # Create a new instance to capture the producer config
+        with patch("src.services.kafka_service.Producer", return_value=mock_producer) as producer_cls:
+            KafkaService()
+
+        # Verify batches are compressed on the wire
+        producer_config = producer_cls.call_args[0][0]
+        assert producer_config["compression.type"] == "lz4"
+
+    def test_init_producer_delivery_report(self, mock_producer):
+        # Create a new instance to capture the producer config
+        with patch("src.services.kafka_service.Producer", return_value=mock_producer) as producer_cls:
+            service = KafkaService()
+
+        # Verify a single producer-wide callback reports failed deliveries only
+        producer_config = producer_cls.call_args[0][0]
+        assert producer_config["on_delivery"] == service._delivery_report
+        assert producer_config["delivery.report.only.error"] is True
+
     def test_publish_screenshots_completed(self, kafka_service, mock_producer, test_data):
         catalog_id = test_data["catalog_id"]
         request_id = test_data["request_id"]
@@ -34,35 +59,54 @@ class TestKafkaService:
         assert args[0] == kafka_service.kafka_config.screenshots_completed_topic
         assert "value" in kwargs
 
-        # Verify message JSON
-        message_json = kwargs["value"].decode("utf-8")
-        message = json.loads(message_json)
+        # Verify message JSON, parsed straight from the produced bytes
+        message = orjson.loads(kwargs["value"])
 
         assert message["catalog_id"] == catalog_id
         assert message["request_id"] == request_id
         assert message["screenshot_urls"] == screenshot_urls
         assert message["status"] == "completed"
 
-        # Verify callback was provided
-        assert "callback" in kwargs
-        assert callable(kwargs["callback"])
+        # Verify no per-message callback was allocated
+        assert "callback" not in kwargs
 
-        # Verify flush was called
-        mock_producer.flush.assert_called_once()
+        # Verify delivery reports are served without flushing
+        mock_producer.poll.assert_called_once_with(0)
+        mock_producer.flush.assert_not_called()
 
-    def test_delivery_report_success(self, kafka_service):
-        # Create a mock message
-        msg = MagicMock()
-        msg.topic.return_value = "test-topic"
-        msg.partition.return_value = 0
+    def test_publish_screenshots_completed_queue_full(self, kafka_service, mock_producer, test_data):
+        # Setup producer queue to be full once, then accept the message
+        mock_producer.produce.side_effect = [BufferError(), None]
+
+        kafka_service.publish_screenshots_completed(
+            test_data["catalog_id"], test_data["request_id"], test_data["screenshot_urls"]
+        )
+
+        # Verify message was retried after waiting for deliveries
+        assert mock_producer.produce.call_count == 2
+        mock_producer.poll.assert_any_call(1.0)
+
+    def test_publish_screenshots_completed_queue_stays_full(self, kafka_service, mock_producer, test_data):
+        # Setup producer queue to stay full
+        mock_producer.produce.side_effect = BufferError()
 
-        # Call the method with no error
         with patch("src.services.kafka_service.logger") as logger_mock:
-            kafka_service._delivery_report(None, msg)
+            kafka_service.publish_screenshots_completed(
+                test_data["catalog_id"], test_data["request_id"], test_data["screenshot_urls"]
+            )
 
-            # Verify logger.debug was called
-            logger_mock.debug.assert_called_once()
-            assert "Message delivered" in logger_mock.debug.call_args[0][0]
+            # Verify retries are bounded and the failure is logged
+            assert mock_producer.produce.call_count == PRODUCE_RETRY_ATTEMPTS
+            logger_mock.error.assert_called_once()
+            assert "producer queue is full" in logger_mock.error.call_args[0][0]
+
+    def test_close_flushes(self, kafka_service, mock_producer):
+        mock_producer.flush.return_value = 0
+
+        kafka_service.close()
+
+        # Verify queued messages are flushed
+        mock_producer.flush.assert_called_once_with(30)
 
     def test_delivery_report_error(self, kafka_service):
         # Create a mock error
@@ -167,8 +211,8 @@ class TestKafkaService:
         message.topic.return_value = kafka_service.kafka_config.screenshots_requested_topic
         message.value.return_value = sample_screenshot_request.model_dump_json().encode("utf-8")
 
-        # Set up consumer to return message once, then set running to False
-        mock_consumer.poll.return_value = message
+        # Set up consumer to return a batch with the message, then set running to False
+        mock_consumer.consume.return_value = [message]
 
         # Set running flag to True
         kafka_service.running = True
@@ -186,8 +230,8 @@ class TestKafkaService:
         # Call the method
         kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
 
-        # Verify poll was called
-        mock_consumer.poll.assert_called()
+        # Verify consume was called
+        mock_consumer.consume.assert_called()
 
         # Verify handler was called with correct request
         screenshots_requested_handler.assert_called_once()
@@ -213,8 +257,8 @@ class TestKafkaService:
         message.topic.return_value = kafka_service.kafka_config.peer_available_topic
         message.value.return_value = sample_peer_with_media.model_dump_json().encode("utf-8")
 
-        # Set up consumer to return message once
-        mock_consumer.poll.return_value = message
+        # Set up consumer to return a batch with the message
+        mock_consumer.consume.return_value = [message]
 
         # Set running flag to True
         kafka_service.running = True
@@ -232,8 +276,8 @@ class TestKafkaService:
         # Call the method
         kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
 
-        # Verify poll was called
-        mock_consumer.poll.assert_called()
+        # Verify consume was called
+        mock_consumer.consume.assert_called()
 
         # Verify handler was called with correct peer
         peer_available_handler.assert_called_once()
@@ -249,6 +293,77 @@ class TestKafkaService:
         # Verify consumer was closed
         mock_consumer.close.assert_called_once()
 
+    def test_consume_loop_batch(self, kafka_service, mock_consumer, sample_screenshot_request,
+                                sample_peer_with_media):
+        # Create handlers
+        screenshots_requested_handler = MagicMock()
+        peer_available_handler = MagicMock()
+
+        # Set up a batch with one message per topic
+        request_message = MagicMock()
+        request_message.error.return_value = None
+        request_message.topic.return_value = kafka_service.kafka_config.screenshots_requested_topic
+        request_message.value.return_value = sample_screenshot_request.model_dump_json().encode("utf-8")
+
+        peer_message = MagicMock()
+        peer_message.error.return_value = None
+        peer_message.topic.return_value = kafka_service.kafka_config.peer_available_topic
+        peer_message.value.return_value = sample_peer_with_media.model_dump_json().encode("utf-8")
+
+        mock_consumer.consume.return_value = [request_message, peer_message]
+
+        # Stop the loop while the first message is handled
+        def stop_after_call(request):
+            kafka_service.running = False
+
+        screenshots_requested_handler.side_effect = stop_after_call
+
+        kafka_service.running = True
+        kafka_service.consumer = mock_consumer
+
+        # Call the method
+        kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
+
+        # Verify a single batch was fetched
+        mock_consumer.consume.assert_called_once_with(num_messages=CONSUME_BATCH_SIZE, timeout=CONSUME_TIMEOUT)
+
+        # Verify the whole batch was dispatched
+        screenshots_requested_handler.assert_called_once()
+        peer_available_handler.assert_called_once()
+
+    def test_consume_loop_invalid_message(self, kafka_service, mock_consumer):
+        # Create handlers
+        screenshots_requested_handler = MagicMock()
+        peer_available_handler = MagicMock()
+
+        # Set up a message that is not valid JSON
+        message = MagicMock()
+        message.error.return_value = None
+        message.topic.return_value = kafka_service.kafka_config.screenshots_requested_topic
+        message.value.return_value = b"not-json"
+
+        # Return the message once, then stop the loop
+        def consume(*args, **kwargs):
+            kafka_service.running = False
+            return [message]
+
+        mock_consumer.consume.side_effect = consume
+
+        kafka_service.running = True
+        kafka_service.consumer = mock_consumer
+
+        # Call the method with logger mock
+        with patch("src.services.kafka_service.logger") as logger_mock:
+            kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
+
+            # Verify the parse failure was logged
+            logger_mock.error.assert_called_once()
+            assert "Failed to process message" in logger_mock.error.call_args[0][0]
+
+        # Verify no handlers were called
+        screenshots_requested_handler.assert_not_called()
+        peer_available_handler.assert_not_called()
+
     def test_consume_loop_message_error_partition_eof(self, kafka_service, mock_consumer):
         # Create handlers
         screenshots_requested_handler = MagicMock()
@@ -262,19 +377,18 @@ class TestKafkaService:
 
         # Set up mock response sequence - first return the error message, then set running to False
         # to avoid recursion
-        original_poll = mock_consumer.poll
         call_count = 0
 
-        def mock_poll_with_count(*args, **kwargs):
+        def mock_consume_with_count(*args, **kwargs):
             nonlocal call_count
             call_count += 1
             if call_count == 1:
-                return message
+                return [message]
             else:
                 kafka_service.running = False
-                return None
+                return []
 
-        mock_consumer.poll = mock_poll_with_count
+        mock_consumer.consume = mock_consume_with_count
 
         # Set running flag to True
         kafka_service.running = True
@@ -285,7 +399,7 @@ class TestKafkaService:
         # Call the method
         kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
 
-        # Verify poll was called
+        # Verify consume was called
         assert call_count > 0
 
         # Verify no handlers were called
@@ -307,19 +421,18 @@ class TestKafkaService:
         message.error.return_value = error
 
         # Set up mock response sequence - first return the error message, then set running to False
-        original_poll = mock_consumer.poll
         call_count = 0
 
-        def mock_poll_with_count(*args, **kwargs):
+        def mock_consume_with_count(*args, **kwargs):
             nonlocal call_count
             call_count += 1
             if call_count == 1:
-                return message
+                return [message]
             else:
                 kafka_service.running = False
-                return None
+                return []
 
-        mock_consumer.poll = mock_poll_with_count
+        mock_consumer.consume = mock_consume_with_count
 
         # Set running flag to True
         kafka_service.running = True
@@ -331,7 +444,7 @@ class TestKafkaService:
         with patch("src.services.kafka_service.logger") as logger_mock:
             kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
 
-            # Verify poll was called
+            # Verify consume was called
             assert call_count > 0
 
             # Verify logger.error was called
@@ -351,7 +464,7 @@ class TestKafkaService:
         peer_available_handler = MagicMock()
 
         # Set up consumer to raise KafkaException
-        mock_consumer.poll.side_effect = KafkaException("Kafka error")
+        mock_consumer.consume.side_effect = KafkaException("Kafka error")
 
         # Set running flag to True
         kafka_service.running = True
@@ -363,8 +476,8 @@ class TestKafkaService:
         with patch("src.services.kafka_service.logger") as logger_mock:
             kafka_service._consume_loop(screenshots_requested_handler, peer_available_handler)
 
-            # Verify poll was called
-            mock_consumer.poll.assert_called_once()
+            # Verify consume was called
+            mock_consumer.consume.assert_called_once()
 
             # Verify logger.error was called
             logger_mock.error.assert_called_once()
@@ -1,20 +1,30 @@
 import json
+from datetime import datetime, timedelta
+from unittest.mock import call, patch
 
-from freezegun import freeze_time
+import pytest
 
-from tests.conftest import *  # Import all fixtures
+from src.models import ScreenshotRequest
+from src.services.redis_service import REMOVE_PENDING_REQUEST_SCRIPT
+from tests.fakes import FakeClock
 
 
 @pytest.mark.unit
 class TestRedisService:
-    def test_add_pending_request_with_expiration(self, redis_service, mock_redis, sample_screenshot_request):
+    @pytest.mark.asyncio
+    async def test_add_pending_request_with_expiration(self, redis_service, mock_redis, sample_screenshot_request):
         # Call the method
-        redis_service.add_pending_request(sample_screenshot_request)
+        await redis_service.add_pending_request(sample_screenshot_request)
+
+        # Verify commands were sent in a single non-transactional pipeline
+        mock_redis.pipeline.assert_called_once_with(transaction=False)
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.assert_called_once()
 
         # Verify Redis hset was called with correct parameters
         catalog_key = f"{redis_service.redis_config.pending_requests_prefix}{sample_screenshot_request.catalog_id}"
-        mock_redis.hset.assert_called_once()
-        args, kwargs = mock_redis.hset.call_args
+        pipe.hset.assert_called_once()
+        args, kwargs = pipe.hset.call_args
 
         assert args[0] == catalog_key
         assert args[1] == sample_screenshot_request.request_id
@@ -27,72 +37,80 @@ class TestRedisService:
         assert request_json["requester_service"] == sample_screenshot_request.requester_service
 
         # Verify Redis expire was called with correct TTL
-        mock_redis.expire.assert_called_once()
-        args, kwargs = mock_redis.expire.call_args
+        pipe.expire.assert_called_once()
+        args, kwargs = pipe.expire.call_args
         assert args[0] == catalog_key
         # TTL should be positive
         assert args[1] > 0
 
-    def test_add_pending_request_without_expiration(self, redis_service, mock_redis, sample_screenshot_request):
+        # Verify the catalog was indexed until the hash expires
+        pipe.zadd.assert_called_once()
+        args, kwargs = pipe.zadd.call_args
+        assert args[0] == redis_service.redis_config.pending_catalogs_index_key
+        assert args[1] == {sample_screenshot_request.catalog_id: sample_screenshot_request.expires_at.timestamp()}
+
+    @pytest.mark.asyncio
+    async def test_add_pending_request_without_expiration(self, redis_service, mock_redis, sample_screenshot_request,
+                                                          monkeypatch):
         # Remove expiration time to test auto-setting it
         sample_screenshot_request.expires_at = None
 
-        # Set the created_at time to match our frozen time to avoid timing issues
+        # Freeze the clock the service reads at the request's creation time
         frozen_time = datetime(2025, 5, 13, 12, 0, 0)
+        sample_screenshot_request.created_at = frozen_time
+        monkeypatch.setattr("src.services.redis_service.time", FakeClock(frozen_time.timestamp()))
 
-        with freeze_time(frozen_time):
-            # Set the created_at to the frozen time
-            sample_screenshot_request.created_at = frozen_time
-
-            # Call the method
-            redis_service.add_pending_request(sample_screenshot_request)
+        # Call the method
+        await redis_service.add_pending_request(sample_screenshot_request)
 
-            # Verify Redis expire was called with correct TTL based on service config
-            mock_redis.expire.assert_called_once()
-            ttl = mock_redis.expire.call_args[0][1]
-            expected_ttl = redis_service.service_config.pending_request_ttl_hours * 3600
+        # Verify Redis expire was called with correct TTL based on service config
+        pipe = mock_redis.pipeline.return_value
+        pipe.expire.assert_called_once()
+        ttl = pipe.expire.call_args[0][1]
+        expected_ttl = redis_service.service_config.pending_request_ttl_hours * 3600
 
-            # Allow small difference due to execution time
-            assert abs(ttl - expected_ttl) < 10
+        assert ttl == expected_ttl
 
-    def test_add_pending_request_expired(self, redis_service, mock_redis, sample_screenshot_request):
+    @pytest.mark.asyncio
+    async def test_add_pending_request_expired(self, redis_service, mock_redis, sample_screenshot_request):
         # Set expiration time in the past
         sample_screenshot_request.expires_at = datetime.now() - timedelta(hours=1)
 
         # Call the method
-        redis_service.add_pending_request(sample_screenshot_request)
+        with patch.object(ScreenshotRequest, "model_dump_json") as dump_mock:
+            await redis_service.add_pending_request(sample_screenshot_request)
 
-        # Verify Redis hset and expire were not called
-        mock_redis.hset.assert_not_called()
-        mock_redis.expire.assert_not_called()
+        # Verify the request was neither serialized nor written to Redis
+        dump_mock.assert_not_called()
+        mock_redis.pipeline.assert_not_called()
 
-    def test_get_pending_requests_empty(self, redis_service, mock_redis, test_data):
+    @pytest.mark.asyncio
+    async def test_get_pending_requests_empty(self, redis_service, mock_redis, test_data):
         # Setup Redis to return empty hash
-        mock_redis.hgetall.return_value = {}
+        mock_redis.hvals.return_value = []
 
         # Call the method
-        result = redis_service.get_pending_requests(test_data["catalog_id"])
+        result = await redis_service.get_pending_requests(test_data["catalog_id"])
 
-        # Verify Redis hgetall was called with correct key
+        # Verify Redis hvals was called with correct key
         catalog_key = f"{redis_service.redis_config.pending_requests_prefix}{test_data['catalog_id']}"
-        mock_redis.hgetall.assert_called_once_with(catalog_key)
+        mock_redis.hvals.assert_called_once_with(catalog_key)
 
         # Verify result
         assert result == []
 
-    def test_get_pending_requests_with_data(self, redis_service, mock_redis, test_data, sample_screenshot_request):
+    @pytest.mark.asyncio
+    async def test_get_pending_requests_with_data(self, redis_service, mock_redis, test_data, sample_screenshot_request):
         # Setup Redis to return a hash with a request
         request_json = sample_screenshot_request.model_dump_json()
-        mock_redis.hgetall.return_value = {
-            sample_screenshot_request.request_id.encode("utf-8"): request_json.encode("utf-8")
-        }
+        mock_redis.hvals.return_value = [request_json.encode("utf-8")]
 
         # Call the method
-        result = redis_service.get_pending_requests(test_data["catalog_id"])
+        result = await redis_service.get_pending_requests(test_data["catalog_id"])
 
-        # Verify Redis hgetall was called with correct key
+        # Verify Redis hvals was called with correct key
         catalog_key = f"{redis_service.redis_config.pending_requests_prefix}{test_data['catalog_id']}"
-        mock_redis.hgetall.assert_called_once_with(catalog_key)
+        mock_redis.hvals.assert_called_once_with(catalog_key)
 
         # Verify result
         assert len(result) == 1
@@ -100,31 +118,69 @@ class TestRedisService:
         assert result[0].catalog_id == sample_screenshot_request.catalog_id
         assert result[0].request_id == sample_screenshot_request.request_id
         assert result[0].requester_service == sample_screenshot_request.requester_service
+        assert result[0].created_at == sample_screenshot_request.created_at
+        assert result[0].expires_at == sample_screenshot_request.expires_at
+
+    @pytest.mark.asyncio
+    async def test_get_pending_requests_bulk(self, redis_service, mock_redis, sample_screenshot_request):
+        catalog_ids = [sample_screenshot_request.catalog_id, "another-catalog-id"]
+
+        # Setup pipeline to return one request for the first catalog_id only
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [
+            [sample_screenshot_request.model_dump_json().encode("utf-8")],
+            [],
+        ]
+
+        # Call the method
+        result = await redis_service.get_pending_requests_bulk(catalog_ids)
 
-    def test_remove_pending_request(self, redis_service, mock_redis, test_data):
+        # Verify every hash was read in a single pipeline
+        mock_redis.pipeline.assert_called_once_with(transaction=False)
+        prefix = redis_service.redis_config.pending_requests_prefix
+        assert pipe.hvals.call_args_list == [call(f"{prefix}{catalog_id}") for catalog_id in catalog_ids]
+        pipe.execute.assert_called_once()
+
+        # Verify result
+        assert list(result) == catalog_ids
+        assert result[catalog_ids[1]] == []
+        assert len(result[catalog_ids[0]]) == 1
+        assert result[catalog_ids[0]][0].request_id == sample_screenshot_request.request_id
+
+    @pytest.mark.asyncio
+    async def test_remove_pending_request(self, redis_service, mock_redis, test_data):
         catalog_id = test_data["catalog_id"]
         request_id = test_data["request_id"]
 
         # Call the method
-        redis_service.remove_pending_request(catalog_id, request_id)
+        await redis_service.remove_pending_request(catalog_id, request_id)
 
-        # Verify Redis hdel was called with correct parameters
+        # Verify the request and, if it was the last one, the index entry were removed atomically
         catalog_key = f"{redis_service.redis_config.pending_requests_prefix}{catalog_id}"
-        mock_redis.hdel.assert_called_once_with(catalog_key, request_id)
-
-    def test_get_all_pending_catalog_ids(self, redis_service, mock_redis):
-        # Setup Redis to return keys
-        prefix = redis_service.redis_config.pending_requests_prefix
-        mock_redis.keys.return_value = [
-            f"{prefix}catalog-1".encode("utf-8"),
-            f"{prefix}catalog-2".encode("utf-8"),
-        ]
+        mock_redis.register_script.assert_called_once_with(REMOVE_PENDING_REQUEST_SCRIPT)
+        mock_redis.register_script.return_value.assert_called_once_with(
+            keys=[catalog_key, redis_service.redis_config.pending_catalogs_index_key],
+            args=[request_id, catalog_id]
+        )
+
+    @pytest.mark.asyncio
+    async def test_get_all_pending_catalog_ids(self, redis_service, mock_redis):
+        # Setup the index to return catalog_ids after dropping expired ones
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [0, [b"catalog-1", b"catalog-2"]]
 
         # Call the method
-        result = redis_service.get_all_pending_catalog_ids()
+        result = await redis_service.get_all_pending_catalog_ids()
+
+        # Verify expired catalogs were dropped and the index was read in one round trip
+        index_key = redis_service.redis_config.pending_catalogs_index_key
+        assert pipe.zremrangebyscore.call_args[0][:2] == (index_key, "-inf")
+        pipe.zrange.assert_called_once_with(index_key, 0, -1)
+        pipe.execute.assert_called_once()
 
-        # Verify Redis keys was called with correct pattern
-        mock_redis.keys.assert_called_once_with(f"{prefix}*")
+        # Verify the keyspace was not scanned
+        mock_redis.scan_iter.assert_not_called()
+        mock_redis.keys.assert_not_called()
 
         # Verify result
         assert result == {"catalog-1", "catalog-2"}
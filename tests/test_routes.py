@@ -1,19 +1,31 @@
+import asyncio
+import logging
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
 from fastapi import HTTPException, status, FastAPI
+from fastapi.testclient import TestClient
 
 from src.api.routes import router, validate_token
-from src.main import app
-from tests.conftest import *  # Import all fixtures
+from src.dependencies import get_redis_service, get_storage_service, get_token_service
+from src.main import app, lifespan
+from src.models import TokenBlacklistReason, TokenValidationResult
+from src.services.kafka_service import KafkaService
+from src.services.screenshot_service import ScreenshotService
+from src.services.token_service import TokenService
+from tests.fakes import log_messages
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def app_with_routes():
-    """Create FastAPI app with routes for testing."""
+    """Create FastAPI app with routes for testing, shared since no test modifies it."""
     test_app = FastAPI()
     test_app.include_router(router)
     return test_app
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def route_test_client(app_with_routes):
     """Create test client for routes."""
     return TestClient(app_with_routes)
@@ -22,11 +34,12 @@ def route_test_client(app_with_routes):
 @pytest.mark.unit
 class TestRoutes:
     @pytest.mark.asyncio
-    async def test_validate_token_valid(self):
+    async def test_validate_token_valid(self, sample_token_payload):
         # Setup token_service mock
-        token_service = MagicMock()
-        sample_token_payload = MagicMock(spec=TokenPayload)
-        token_service.validate_token.return_value = sample_token_payload
+        token_service = MagicMock(spec=TokenService)
+        token_service.validate_token.return_value = TokenValidationResult(
+            payload=sample_token_payload, token_id=sample_token_payload.token_id
+        )
 
         # Call the function
         result = await validate_token("Bearer valid-token", token_service)
@@ -40,7 +53,7 @@ class TestRoutes:
     @pytest.mark.asyncio
     async def test_validate_token_invalid_header(self):
         # Setup token_service mock
-        token_service = MagicMock()
+        token_service = MagicMock(spec=TokenService)
 
         # Call the function with invalid header
         with pytest.raises(HTTPException) as excinfo:
@@ -56,27 +69,101 @@ class TestRoutes:
     @pytest.mark.asyncio
     async def test_validate_token_invalid_token(self):
         # Setup token_service mock
-        token_service = MagicMock()
-        token_service.validate_token.return_value = None
-        token_service.get_blacklist_reason.return_value = None
+        token_service = MagicMock(spec=TokenService)
+        token_service.validate_token.return_value = TokenValidationResult(token_id="test-token-id")
+
+        # Call the function
+        with pytest.raises(HTTPException) as excinfo:
+            await validate_token("Bearer invalid-token", token_service)
+
+        # Verify exception details
+        assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
+        assert "Invalid or expired token" in excinfo.value.detail
+
+        # Verify token_service.validate_token was called
+        token_service.validate_token.assert_called_once_with("invalid-token")
+
+        # Verify blacklist reason was not looked up separately
+        token_service.get_blacklist_reason.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_validate_token_already_used(self):
+        # Setup token_service mock
+        token_service = MagicMock(spec=TokenService)
+        token_service.validate_token.return_value = TokenValidationResult(
+            token_id="test-token-id", reason=TokenBlacklistReason.ALREADY_USED
+        )
+
+        # Call the function
+        response = await validate_token("Bearer used-token", token_service)
+
+        # Verify blacklisted token is rejected with specific error
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert b"Token has already been used" in response.body
 
-        # Mock jwt.decode to return a token_id
-        with patch("src.api.routes.jwt.decode") as jwt_decode_mock:
-            jwt_decode_mock.return_value = {"token_id": "test-token-id"}
 
-            # Call the function
-            with pytest.raises(HTTPException) as excinfo:
-                await validate_token("Bearer invalid-token", token_service)
+@pytest.fixture
+def lifespan_services(patched_minio):
+    """Build lifespan services from fresh factory caches, dropping them afterwards."""
+    factories = (get_token_service, get_redis_service, get_storage_service)
+    for factory in factories:
+        factory.cache_clear()
+    yield
+    for factory in factories:
+        factory.cache_clear()
 
-            # Verify exception details
-            assert excinfo.value.status_code == status.HTTP_401_UNAUTHORIZED
-            assert "Invalid or expired token" in excinfo.value.detail
 
-            # Verify token_service.validate_token was called
-            token_service.validate_token.assert_called_once_with("invalid-token")
+@pytest.mark.unit
+@pytest.mark.usefixtures("lifespan_services")
+class TestLifespan:
+    @pytest.mark.asyncio
+    async def test_kafka_events_dispatched_from_consumer_thread(self, sample_screenshot_request, sample_peer_with_media):
+        # Setup service mocks
+        kafka_service = MagicMock(spec=KafkaService)
+        screenshot_service = MagicMock(spec=ScreenshotService)
+        screenshot_service.handle_screenshot_request = AsyncMock()
+        screenshot_service.handle_peer_available = AsyncMock()
+        http_client = AsyncMock()
+
+        with patch("src.main.get_kafka_service", return_value=kafka_service), \
+                patch("src.main.get_screenshot_service", return_value=screenshot_service), \
+                patch("src.main.get_http_client", return_value=http_client):
+            async with lifespan(app):
+                handlers = kafka_service.start_consuming.call_args.kwargs
+
+                # Invoke handlers from a separate thread, as the Kafka consumer does
+                consumer_thread = threading.Thread(target=lambda: (
+                    handlers["screenshots_requested_handler"](sample_screenshot_request),
+                    handlers["peer_available_handler"](sample_peer_with_media)
+                ))
+                consumer_thread.start()
+                await asyncio.to_thread(consumer_thread.join)
+
+        # Verify events were handled on the loop before shutdown completed
+        screenshot_service.handle_screenshot_request.assert_awaited_once_with(sample_screenshot_request)
+        screenshot_service.handle_peer_available.assert_awaited_once_with(sample_peer_with_media)
+        kafka_service.stop_consuming.assert_called_once()
+        kafka_service.close.assert_called_once()
+        http_client.aclose.assert_awaited_once()
 
-            # Verify token_service.get_blacklist_reason was called
-            token_service.get_blacklist_reason.assert_called_once_with("test-token-id")
+    @pytest.mark.asyncio
+    async def test_kafka_events_handled_by_wired_screenshot_service(self, caplog, mock_redis, mock_httpx_client,
+                                                                    sample_screenshot_request):
+        # Only the external clients are replaced; the services are built by the real factories
+        kafka_service = MagicMock(spec=KafkaService)
+
+        with patch("src.main.get_kafka_service", return_value=kafka_service), \
+                patch("src.main.get_redis_client", return_value=mock_redis), \
+                patch("src.main.get_http_client", return_value=mock_httpx_client), \
+                caplog.at_level(logging.ERROR, logger="src.main"):
+            async with lifespan(app):
+                handler = kafka_service.start_consuming.call_args.kwargs["screenshots_requested_handler"]
+                await asyncio.to_thread(handler, sample_screenshot_request)
+
+        # Verify the event reached Redis and the Peer Registry through real services
+        mock_redis.pipeline.return_value.execute.assert_awaited_once()
+        mock_httpx_client.get.assert_awaited_once()
+        assert log_messages(caplog, logging.ERROR) == []
 
 
 @pytest.mark.skip
@@ -1,24 +1,25 @@
-from unittest.mock import call
+import asyncio
+import logging
+from unittest.mock import AsyncMock, call
 
-from src.models import TokenBlacklistReason
-from tests.conftest import *  # Import all fixtures
+import pytest
+
+from src.models import PeerWithMedia, TokenBlacklistReason
+from tests.fakes import FakeResponse, log_messages
 
 
 @pytest.mark.unit
 class TestScreenshotService:
     @pytest.mark.asyncio
     async def test_handle_screenshot_request_no_peers(self, screenshot_service, sample_screenshot_request):
-        # Setup redis_service to store request
-        screenshot_service.redis_service.add_pending_request = MagicMock()
-
         # Setup _get_peers_with_catalog_id to return empty list
         screenshot_service._get_peers_with_catalog_id = AsyncMock(return_value=[])
 
         # Call the method
         await screenshot_service.handle_screenshot_request(sample_screenshot_request)
 
-        # Verify redis_service.add_pending_request was called
-        screenshot_service.redis_service.add_pending_request.assert_called_once_with(sample_screenshot_request)
+        # Verify the request was stored as pending
+        assert screenshot_service.redis_service.added_requests == [sample_screenshot_request]
 
         # Verify _get_peers_with_catalog_id was called
         screenshot_service._get_peers_with_catalog_id.assert_called_once_with(sample_screenshot_request.catalog_id)
@@ -26,9 +27,6 @@ class TestScreenshotService:
     @pytest.mark.asyncio
     async def test_handle_screenshot_request_with_peers(self, screenshot_service, sample_screenshot_request,
                                                         sample_peer_with_media):
-        # Setup redis_service to store request
-        screenshot_service.redis_service.add_pending_request = MagicMock()
-
         # Setup _get_peers_with_catalog_id to return peers
         screenshot_service._get_peers_with_catalog_id = AsyncMock(return_value=[sample_peer_with_media])
 
@@ -38,8 +36,8 @@ class TestScreenshotService:
         # Call the method
         await screenshot_service.handle_screenshot_request(sample_screenshot_request)
 
-        # Verify redis_service.add_pending_request was called
-        screenshot_service.redis_service.add_pending_request.assert_called_once_with(sample_screenshot_request)
+        # Verify the request was stored as pending
+        assert screenshot_service.redis_service.added_requests == [sample_screenshot_request]
 
         # Verify _get_peers_with_catalog_id was called
         screenshot_service._get_peers_with_catalog_id.assert_called_once_with(sample_screenshot_request.catalog_id)
@@ -49,31 +47,55 @@ class TestScreenshotService:
             sample_peer_with_media, sample_screenshot_request
         )
 
+    @pytest.mark.asyncio
+    async def test_handle_screenshot_request_peers_concurrent(self, screenshot_service, sample_screenshot_request,
+                                                              sample_peer_with_media):
+        # Setup two peers with the catalog_id
+        other_peer = PeerWithMedia(peer_id="other-peer-id", edge_id="other-edge-id",
+                                   catalog_ids=sample_peer_with_media.catalog_ids)
+        peers = [sample_peer_with_media, other_peer]
+        screenshot_service._get_peers_with_catalog_id = AsyncMock(return_value=peers)
+
+        # Each request only completes once both have started
+        started = []
+        both_started = asyncio.Event()
+
+        async def request_screenshots(peer, request):
+            started.append(peer)
+            if len(started) == len(peers):
+                both_started.set()
+            await both_started.wait()
+
+        screenshot_service._request_screenshots_from_peer = request_screenshots
+
+        # Call the method; serial fan-out would never finish
+        await asyncio.wait_for(screenshot_service.handle_screenshot_request(sample_screenshot_request), timeout=1.0)
+
+        # Verify every peer was requested
+        assert started == peers
+
     @pytest.mark.asyncio
     async def test_handle_peer_available_no_pending_requests(self, screenshot_service, sample_peer_with_media):
-        # Setup redis_service to return no pending requests
-        screenshot_service.redis_service.get_pending_requests = MagicMock(return_value=[])
+        # No pending requests are stored for any catalog_id
+        screenshot_service._request_screenshots_from_peer = AsyncMock()
 
         # Call the method
         await screenshot_service.handle_peer_available(sample_peer_with_media)
 
-        # Verify redis_service.get_pending_requests was called for each catalog_id
-        calls = [
-            call(catalog_id) for catalog_id in sample_peer_with_media.catalog_ids
-        ]
-        screenshot_service.redis_service.get_pending_requests.assert_has_calls(calls)
+        # Verify pending requests were fetched for all catalog_ids at once
+        assert screenshot_service.redis_service.bulk_lookups == [sample_peer_with_media.catalog_ids]
+
+        # Verify no screenshots were requested
+        screenshot_service._request_screenshots_from_peer.assert_not_called()
 
     @pytest.mark.asyncio
     async def test_handle_peer_available_with_pending_requests(
             self, screenshot_service, sample_peer_with_media, sample_screenshot_request
     ):
         # Setup redis_service to return pending requests for first catalog_id
-        def get_pending_requests(catalog_id):
-            if catalog_id == sample_peer_with_media.catalog_ids[0]:
-                return [sample_screenshot_request]
-            return []
-
-        screenshot_service.redis_service.get_pending_requests = MagicMock(side_effect=get_pending_requests)
+        screenshot_service.redis_service.pending_requests = {
+            sample_peer_with_media.catalog_ids[0]: [sample_screenshot_request],
+        }
 
         # Setup _request_screenshots_from_peer
         screenshot_service._request_screenshots_from_peer = AsyncMock()
@@ -81,11 +103,8 @@ class TestScreenshotService:
         # Call the method
         await screenshot_service.handle_peer_available(sample_peer_with_media)
 
-        # Verify redis_service.get_pending_requests was called for each catalog_id
-        calls = [
-            call(catalog_id) for catalog_id in sample_peer_with_media.catalog_ids
-        ]
-        screenshot_service.redis_service.get_pending_requests.assert_has_calls(calls)
+        # Verify pending requests were fetched for all catalog_ids at once
+        assert screenshot_service.redis_service.bulk_lookups == [sample_peer_with_media.catalog_ids]
 
         # Verify _request_screenshots_from_peer was called
         screenshot_service._request_screenshots_from_peer.assert_called_once()
@@ -101,18 +120,15 @@ class TestScreenshotService:
 
     @pytest.mark.asyncio
     async def test_get_peers_with_catalog_id_success(self, screenshot_service, test_data, sample_peer_with_media,
-                                                     mock_httpx_client):
+                                                     sample_peer_dump, mock_httpx_client):
         catalog_id = test_data["catalog_id"]
 
         # Setup httpx client to return peers
-        response = MagicMock()
-        response.status_code = 200
-        response.json.return_value = [sample_peer_with_media.model_dump()]
+        response = FakeResponse(status_code=200, json_data=[sample_peer_dump])
         mock_httpx_client.get.return_value = response
 
         # Call the method
-        with patch("httpx.AsyncClient", return_value=mock_httpx_client):
-            result = await screenshot_service._get_peers_with_catalog_id(catalog_id)
+        result = await screenshot_service._get_peers_with_catalog_id(catalog_id)
 
         # Verify httpx client was called with correct URL
         expected_url = f"{screenshot_service.service_config.peer_registry_url}/api/peers/catalog/{catalog_id}"
@@ -126,52 +142,109 @@ class TestScreenshotService:
         assert result[0].catalog_ids == sample_peer_with_media.catalog_ids
 
     @pytest.mark.asyncio
-    async def test_get_peers_with_catalog_id_error(self, screenshot_service, test_data, mock_httpx_client):
+    async def test_get_peers_with_catalog_id_error(self, caplog, screenshot_service, test_data, mock_httpx_client):
         catalog_id = test_data["catalog_id"]
 
         # Setup httpx client to return error
-        response = MagicMock()
-        response.status_code = 500
-        response.text = "Internal Server Error"
+        response = FakeResponse(status_code=500, text="Internal Server Error")
         mock_httpx_client.get.return_value = response
 
         # Call the method
-        with patch("httpx.AsyncClient", return_value=mock_httpx_client):
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                result = await screenshot_service._get_peers_with_catalog_id(catalog_id)
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            result = await screenshot_service._get_peers_with_catalog_id(catalog_id)
 
-                # Verify logger.error was called
-                logger_mock.error.assert_called_once()
-                assert "Failed to get peers" in logger_mock.error.call_args[0][0]
+            # Verify the error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Failed to get peers" in log_messages(caplog, logging.ERROR)[0]
 
         # Verify result is empty list
         assert result == []
 
     @pytest.mark.asyncio
-    async def test_get_peers_with_catalog_id_exception(self, screenshot_service, test_data):
+    async def test_get_peers_with_catalog_id_exception(self, caplog, screenshot_service, test_data, mock_httpx_client):
         catalog_id = test_data["catalog_id"]
 
-        # Setup httpx.AsyncClient to raise exception
-        with patch("httpx.AsyncClient") as client_mock:
-            client_mock.side_effect = Exception("Test exception")
+        # Setup httpx client to raise exception
+        mock_httpx_client.get.side_effect = Exception("Test exception")
 
-            # Call the method
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                result = await screenshot_service._get_peers_with_catalog_id(catalog_id)
+        # Call the method
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            result = await screenshot_service._get_peers_with_catalog_id(catalog_id)
 
-                # Verify logger.error was called
-                logger_mock.error.assert_called_once()
-                assert "Error getting peers" in logger_mock.error.call_args[0][0]
+            # Verify the error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Error getting peers" in log_messages(caplog, logging.ERROR)[0]
 
         # Verify result is empty list
         assert result == []
 
+    @pytest.mark.asyncio
+    async def test_get_peers_with_catalog_id_cached(self, screenshot_service, test_data, sample_peer_dump,
+                                                    mock_httpx_client):
+        catalog_id = test_data["catalog_id"]
+
+        # Setup httpx client to return peers
+        response = FakeResponse(status_code=200, json_data=[sample_peer_dump])
+        mock_httpx_client.get.return_value = response
+
+        # Call the method twice
+        first = await screenshot_service._get_peers_with_catalog_id(catalog_id)
+        second = await screenshot_service._get_peers_with_catalog_id(catalog_id)
+
+        # Verify Peer Registry was only queried once
+        mock_httpx_client.get.assert_called_once()
+        assert first == second
+
+    @pytest.mark.asyncio
+    async def test_get_peers_with_catalog_id_concurrent(self, screenshot_service, test_data, sample_peer_with_media,
+                                                        sample_peer_dump, mock_httpx_client):
+        catalog_id = test_data["catalog_id"]
+
+        # Setup httpx client to respond only after both lookups have started
+        release = asyncio.Event()
+        response = FakeResponse(status_code=200, json_data=[sample_peer_dump])
+
+        async def get(url):
+            await release.wait()
+            return response
+
+        mock_httpx_client.get.side_effect = get
+
+        # Call the method concurrently
+        lookups = asyncio.gather(
+            screenshot_service._get_peers_with_catalog_id(catalog_id),
+            screenshot_service._get_peers_with_catalog_id(catalog_id),
+        )
+        await asyncio.sleep(0)
+        release.set()
+        first, second = await lookups
+
+        # Verify the concurrent misses shared one request
+        mock_httpx_client.get.assert_called_once()
+        assert first == second == [sample_peer_with_media]
+
+    @pytest.mark.asyncio
+    async def test_get_peers_with_catalog_id_error_not_cached(self, screenshot_service, test_data,
+                                                              mock_httpx_client):
+        catalog_id = test_data["catalog_id"]
+
+        # Setup httpx client to return error
+        response = FakeResponse(status_code=500, text="Internal Server Error")
+        mock_httpx_client.get.return_value = response
+
+        # Call the method twice
+        await screenshot_service._get_peers_with_catalog_id(catalog_id)
+        await screenshot_service._get_peers_with_catalog_id(catalog_id)
+
+        # Verify failed lookups are retried
+        assert mock_httpx_client.get.call_count == 2
+
     @pytest.mark.asyncio
     async def test_request_screenshots_from_peer(
             self, screenshot_service, sample_peer_with_media, sample_screenshot_request, sample_token_info
     ):
         # Setup token_service to create token
-        screenshot_service.token_service.create_token = MagicMock(return_value=sample_token_info)
+        screenshot_service.token_service.token_info = sample_token_info
 
         # Setup _send_screenshot_request_to_edge
         screenshot_service._send_screenshot_request_to_edge = AsyncMock()
@@ -179,38 +252,57 @@ class TestScreenshotService:
         # Call the method
         await screenshot_service._request_screenshots_from_peer(sample_peer_with_media, sample_screenshot_request)
 
-        # Verify token_service.create_token was called for each catalog_id
-        calls = []
-        for catalog_id in sample_peer_with_media.catalog_ids:
-            calls.append(call(
-                peer_id=sample_peer_with_media.peer_id,
-                catalog_id=catalog_id,
-                request_id=sample_screenshot_request.request_id
-            ))
+        # Verify a token was created for each catalog_id
+        assert screenshot_service.token_service.created_tokens == [
+            (sample_peer_with_media.peer_id, catalog_id, sample_screenshot_request.request_id)
+            for catalog_id in sample_peer_with_media.catalog_ids
+        ]
 
-        screenshot_service.token_service.create_token.assert_has_calls(calls)
+        # Verify _send_screenshot_request_to_edge was called exactly once per catalog_id
+        calls = [call(sample_peer_with_media.edge_id, sample_token_info)] * len(sample_peer_with_media.catalog_ids)
+        assert screenshot_service._send_screenshot_request_to_edge.call_args_list == calls
 
-        # Verify _send_screenshot_request_to_edge was called for each catalog_id
-        calls = []
-        for _ in sample_peer_with_media.catalog_ids:
-            calls.append(call(sample_peer_with_media.edge_id, sample_token_info))
+    @pytest.mark.asyncio
+    async def test_request_screenshots_from_peer_concurrent(
+            self, screenshot_service, sample_peer_with_media, sample_screenshot_request, sample_token_info
+    ):
+        screenshot_service.token_service.token_info = sample_token_info
+
+        # Each edge request only completes once all have started
+        started = []
+        all_started = asyncio.Event()
+
+        async def send_screenshot_request(edge_id, token_info):
+            started.append(token_info)
+            if len(started) == len(sample_peer_with_media.catalog_ids):
+                all_started.set()
+            await all_started.wait()
+
+        screenshot_service._send_screenshot_request_to_edge = send_screenshot_request
+
+        # Call the method; serial requests would never finish
+        await asyncio.wait_for(
+            screenshot_service._request_screenshots_from_peer(sample_peer_with_media, sample_screenshot_request),
+            timeout=1.0
+        )
 
-        screenshot_service._send_screenshot_request_to_edge.assert_has_calls(calls)
+        # Verify a request was sent for every catalog_id
+        assert len(started) == len(sample_peer_with_media.catalog_ids)
 
     @pytest.mark.asyncio
     async def test_request_screenshots_from_peer_exception(
-            self, screenshot_service, sample_peer_with_media, sample_screenshot_request
+            self, caplog, screenshot_service, sample_peer_with_media, sample_screenshot_request
     ):
         # Setup token_service to raise exception
-        screenshot_service.token_service.create_token = MagicMock(side_effect=Exception("Test exception"))
+        screenshot_service.token_service.create_token_error = Exception("Test exception")
 
         # Call the method
-        with patch("src.services.screenshot_service.logger") as logger_mock:
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
             await screenshot_service._request_screenshots_from_peer(sample_peer_with_media, sample_screenshot_request)
 
-            # Verify logger.error was called
-            logger_mock.error.assert_called_once()
-            assert "Error requesting screenshots" in logger_mock.error.call_args[0][0]
+            # Verify the error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Error requesting screenshots" in log_messages(caplog, logging.ERROR)[0]
 
     @pytest.mark.asyncio
     async def test_send_screenshot_request_to_edge_success(
@@ -219,13 +311,11 @@ class TestScreenshotService:
         edge_id = test_data["edge_id"]
 
         # Setup httpx client to return success
-        response = MagicMock()
-        response.status_code = 202
+        response = FakeResponse(status_code=202)
         mock_httpx_client.post.return_value = response
 
         # Call the method
-        with patch("httpx.AsyncClient", return_value=mock_httpx_client):
-            await screenshot_service._send_screenshot_request_to_edge(edge_id, sample_token_info)
+        await screenshot_service._send_screenshot_request_to_edge(edge_id, sample_token_info)
 
         # Verify httpx client was called with correct URL and data
         expected_url = f"{screenshot_service.service_config.edge_service_url}/api/edge/{edge_id}/screenshot/request"
@@ -240,162 +330,164 @@ class TestScreenshotService:
 
     @pytest.mark.asyncio
     async def test_send_screenshot_request_to_edge_error(
-            self, screenshot_service, test_data, sample_token_info, mock_httpx_client
+            self, caplog, screenshot_service, test_data, sample_token_info, mock_httpx_client
     ):
         edge_id = test_data["edge_id"]
 
         # Setup httpx client to return error
-        response = MagicMock()
-        response.status_code = 500
-        response.text = "Internal Server Error"
+        response = FakeResponse(status_code=500, text="Internal Server Error")
         mock_httpx_client.post.return_value = response
 
         # Call the method
-        with patch("httpx.AsyncClient", return_value=mock_httpx_client):
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                await screenshot_service._send_screenshot_request_to_edge(edge_id, sample_token_info)
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            await screenshot_service._send_screenshot_request_to_edge(edge_id, sample_token_info)
 
-                # Verify logger.error was called
-                logger_mock.error.assert_called_once()
-                assert "Failed to request screenshots" in logger_mock.error.call_args[0][0]
+            # Verify the error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Failed to request screenshots" in log_messages(caplog, logging.ERROR)[0]
 
     @pytest.mark.asyncio
     async def test_send_screenshot_request_to_edge_exception(
-            self, screenshot_service, test_data, sample_token_info
+            self, caplog, screenshot_service, test_data, sample_token_info, mock_httpx_client
     ):
         edge_id = test_data["edge_id"]
 
-        # Setup httpx.AsyncClient to raise exception
-        with patch("httpx.AsyncClient") as client_mock:
-            client_mock.side_effect = Exception("Test exception")
+        # Setup httpx client to raise exception
+        mock_httpx_client.post.side_effect = Exception("Test exception")
 
-            # Call the method
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                await screenshot_service._send_screenshot_request_to_edge(edge_id, sample_token_info)
+        # Call the method
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            await screenshot_service._send_screenshot_request_to_edge(edge_id, sample_token_info)
 
-                # Verify logger.error was called
-                logger_mock.error.assert_called_once()
-                assert "Error sending screenshot request" in logger_mock.error.call_args[0][0]
+            # Verify the error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Error sending screenshot request" in log_messages(caplog, logging.ERROR)[0]
 
-    def test_process_screenshot_upload(
+    @pytest.mark.asyncio
+    async def test_process_screenshot_upload(
             self, screenshot_service, sample_token_payload, sample_screenshot_files, sample_content_types, test_data
     ):
-        # Setup services
-        screenshot_service.token_service.blacklist_token = MagicMock()
-        screenshot_service.storage_service.upload_screenshot = MagicMock()
-        screenshot_service.storage_service.get_screenshot_url = MagicMock()
-        screenshot_service.redis_service.remove_pending_request = MagicMock()
-        screenshot_service.kafka_service.publish_screenshots_completed = MagicMock()
-        screenshot_service._blacklist_other_tokens = MagicMock()
-
-        # Set up storage_service to return object names
-        object_names = [f"{test_data['catalog_id']}/{i}.jpg" for i in range(len(sample_screenshot_files))]
-        screenshot_service.storage_service.upload_screenshot.side_effect = object_names
+        screenshot_service._blacklist_other_tokens = AsyncMock()
 
-        # Set up storage_service to return URLs
+        # Set up storage_service to return object names; uploads run in threads, so
+        # results are keyed by file rather than by call order
+        object_names = [f"{test_data['catalog_id']}/{i}.jpg" for i in range(len(sample_screenshot_files))]
+        storage_service = screenshot_service.storage_service
+        storage_service.object_names = dict(zip(sample_screenshot_files, object_names))
         screenshot_urls = [f"https://minio/{name}" for name in object_names]
-        screenshot_service.storage_service.get_screenshot_url.side_effect = screenshot_urls
 
         # Call the method
-        result = screenshot_service.process_screenshot_upload(
-            sample_token_payload, sample_screenshot_files, sample_content_types
-        )
-
-        # Verify token_service.blacklist_token was called
-        screenshot_service.token_service.blacklist_token.assert_called_once_with(
-            sample_token_payload.token_id, TokenBlacklistReason.ALREADY_USED
+        file_sizes = [len(file_data.getvalue()) for file_data in sample_screenshot_files]
+        result = await screenshot_service.process_screenshot_upload(
+            sample_token_payload, sample_screenshot_files, sample_content_types, file_sizes
         )
 
-        # Verify storage_service.upload_screenshot was called for each file
-        upload_calls = []
-        for file_data, content_type in zip(sample_screenshot_files, sample_content_types):
-            upload_calls.append(call(
-                sample_token_payload.catalog_id, file_data, content_type
-            ))
-
-        screenshot_service.storage_service.upload_screenshot.assert_has_calls(upload_calls)
+        # Verify the token was blacklisted
+        assert screenshot_service.token_service.blacklisted_tokens == [
+            (sample_token_payload.token_id, TokenBlacklistReason.ALREADY_USED)
+        ]
 
-        # Verify storage_service.get_screenshot_url was called for each object name
-        url_calls = [call(name) for name in object_names]
-        screenshot_service.storage_service.get_screenshot_url.assert_has_calls(url_calls)
+        # Verify each file was uploaded with its length
+        uploads = sorted(storage_service.uploads, key=lambda upload: sample_screenshot_files.index(upload[1]))
+        assert uploads == [
+            (sample_token_payload.catalog_id, file_data, content_type, file_size)
+            for file_data, content_type, file_size in zip(sample_screenshot_files, sample_content_types, file_sizes)
+        ]
 
         # Verify _blacklist_other_tokens was called
         screenshot_service._blacklist_other_tokens.assert_called_once_with(sample_token_payload)
 
-        # Verify redis_service.remove_pending_request was called
-        screenshot_service.redis_service.remove_pending_request.assert_called_once_with(
-            sample_token_payload.catalog_id, sample_token_payload.request_id
-        )
+        # Verify the pending request was removed
+        assert screenshot_service.redis_service.removed_requests == [
+            (sample_token_payload.catalog_id, sample_token_payload.request_id)
+        ]
 
-        # Verify kafka_service.publish_screenshots_completed was called
-        screenshot_service.kafka_service.publish_screenshots_completed.assert_called_once_with(
-            sample_token_payload.catalog_id, sample_token_payload.request_id, screenshot_urls
-        )
+        # Verify screenshots.completed was published
+        assert screenshot_service.kafka_service.completed_events == [
+            (sample_token_payload.catalog_id, sample_token_payload.request_id, screenshot_urls)
+        ]
 
         # Verify result
         assert result == screenshot_urls
 
-    def test_blacklist_other_tokens_success(self, screenshot_service, sample_token_payload, sample_peer_with_media):
+    @pytest.mark.asyncio
+    async def test_process_screenshot_upload_partial_failure(
+            self, caplog, screenshot_service, sample_token_payload, sample_screenshot_files, sample_content_types
+    ):
+        screenshot_service._blacklist_other_tokens = AsyncMock()
+
+        # Set up the first upload to fail
+        screenshot_service.storage_service.failing_files = {sample_screenshot_files[0]}
+
+        # Call the method
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            result = await screenshot_service.process_screenshot_upload(
+                sample_token_payload, sample_screenshot_files, sample_content_types
+            )
+
+            # Verify the failure was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Failed to upload screenshot" in log_messages(caplog, logging.ERROR)[0]
+
+        # Verify only the successful upload is returned and published
+        assert result == ["https://minio/uploaded.jpg"]
+        assert screenshot_service.kafka_service.completed_events == [
+            (sample_token_payload.catalog_id, sample_token_payload.request_id, result)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_blacklist_other_tokens_success(self, caplog, screenshot_service, sample_token_payload,
+                                                  sample_peer_with_media, mock_httpx_client):
         # Setup httpx client response
-        response = MagicMock()
-        response.status_code = 200
-        response.json.return_value = [
+        response = FakeResponse(status_code=200, json_data=[
             {"peer_id": "other-peer-id", "edge_id": "other-edge-id", "catalog_ids": [sample_token_payload.catalog_id]},
             {"peer_id": sample_token_payload.peer_id, "edge_id": "test-edge-id",
              "catalog_ids": [sample_token_payload.catalog_id]}
-        ]
+        ])
 
-        # Call the method
-        with patch("httpx.Client") as client_mock:
-            client_instance = MagicMock()
-            client_instance.__enter__.return_value = client_instance
-            client_instance.get.return_value = response
-            client_mock.return_value = client_instance
+        mock_httpx_client.get.return_value = response
 
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                screenshot_service._blacklist_other_tokens(sample_token_payload)
+        # Call the method
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            await screenshot_service._blacklist_other_tokens(sample_token_payload)
 
-                # Verify logger.info was called for the other peer
-                logger_mock.info.assert_called_once()
-                assert "Blacklisting token for peer" in logger_mock.info.call_args[0][0]
-                assert "other-peer-id" in logger_mock.info.call_args[0][0]
+            # Verify the other peer was logged
+            assert len(log_messages(caplog, logging.INFO)) == 1
+            assert "Blacklisting token for peer" in log_messages(caplog, logging.INFO)[0]
+            assert "other-peer-id" in log_messages(caplog, logging.INFO)[0]
 
-                # Verify httpx client was called with correct URL
-                expected_url = f"{screenshot_service.service_config.peer_registry_url}/api/peers/catalog/{sample_token_payload.catalog_id}"
-                client_instance.get.assert_called_once_with(expected_url)
+            # Verify httpx client was called with correct URL
+            expected_url = f"{screenshot_service.service_config.peer_registry_url}/api/peers/catalog/{sample_token_payload.catalog_id}"
+            mock_httpx_client.get.assert_called_once_with(expected_url)
 
-    def test_blacklist_other_tokens_error(self, screenshot_service, sample_token_payload):
+    @pytest.mark.asyncio
+    async def test_blacklist_other_tokens_error(self, caplog, screenshot_service, sample_token_payload, mock_httpx_client):
         # Setup httpx client response
-        response = MagicMock()
-        response.status_code = 500
-        response.text = "Internal Server Error"
+        response = FakeResponse(status_code=500, text="Internal Server Error")
+
+        mock_httpx_client.get.return_value = response
 
         # Call the method
-        with patch("httpx.Client") as client_mock:
-            client_instance = MagicMock()
-            client_instance.__enter__.return_value = client_instance
-            client_instance.get.return_value = response
-            client_mock.return_value = client_instance
-
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                screenshot_service._blacklist_other_tokens(sample_token_payload)
-
-                # Verify logger.error was called
-                logger_mock.error.assert_called_once()
-                assert "Failed to get peers" in logger_mock.error.call_args[0][0]
-
-                # Verify httpx client was called with correct URL
-                expected_url = f"{screenshot_service.service_config.peer_registry_url}/api/peers/catalog/{sample_token_payload.catalog_id}"
-                client_instance.get.assert_called_once_with(expected_url)
-
-    def test_blacklist_other_tokens_exception(self, screenshot_service, sample_token_payload):
-        # Call the method with httpx.Client raising exception
-        with patch("httpx.Client") as client_mock:
-            client_mock.side_effect = Exception("Test exception")
-
-            with patch("src.services.screenshot_service.logger") as logger_mock:
-                screenshot_service._blacklist_other_tokens(sample_token_payload)
-
-                # Verify logger.error was called
-                logger_mock.error.assert_called_once()
-                assert "Error blacklisting other tokens" in logger_mock.error.call_args[0][0]
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            await screenshot_service._blacklist_other_tokens(sample_token_payload)
+
+            # Verify the error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Failed to get peers" in log_messages(caplog, logging.ERROR)[0]
+
+            # Verify httpx client was called with correct URL
+            expected_url = f"{screenshot_service.service_config.peer_registry_url}/api/peers/catalog/{sample_token_payload.catalog_id}"
+            mock_httpx_client.get.assert_called_once_with(expected_url)
+
+    @pytest.mark.asyncio
+    async def test_blacklist_other_tokens_exception(self, caplog, screenshot_service, sample_token_payload,
+                                                    mock_httpx_client):
+        # Call the method with httpx client raising exception
+        mock_httpx_client.get.side_effect = Exception("Test exception")
+
+        with caplog.at_level(logging.INFO, logger="src.services.screenshot_service"):
+            await screenshot_service._blacklist_other_tokens(sample_token_payload)
+
+            # Verify the lookup error was logged
+            assert len(log_messages(caplog, logging.ERROR)) == 1
+            assert "Error getting peers" in log_messages(caplog, logging.ERROR)[0]
@@ -1,109 +1,204 @@
-import uuid
+import io
+import sys
+from datetime import timedelta
 
-from tests.conftest import *  # Import all fixtures
+import pytest
+from minio.helpers import get_part_info
 
+from src.config import config
+from src.services.storage_service import StorageService
+from tests.fakes import MockS3Error
 
-# Create a mock S3Error class that can be raised as an exception
-class MockS3Error(Exception):
-    def __init__(self, message="Mocked S3 Error"):
-        self.message = message
-        super().__init__(self.message)
+# Upload contents and a known random file id shared by the upload tests
+FAKE_PAYLOAD = b"fake-screenshot-data"
+FILE_ID_STR = "a1b2c3d4e5f6a1b2c3d4e5f6a1b2c3d4"
 
 
 @pytest.mark.unit
 class TestStorageService:
-    def test_init_bucket_exists(self, mock_minio_client):
-        # Reset mock to ensure clean state
+    @pytest.mark.parametrize("bucket_exists, error, bucket_created", [
+        (True, None, False),
+        (False, None, True),
+        (None, MockS3Error("Access Denied"), False),
+    ], ids=["exists", "doesnt_exist", "error"])
+    def test_init_bucket(self, patched_minio, mock_minio_client, bucket_exists, error, bucket_created):
+        # Reset mock and checked buckets to ensure clean state
         mock_minio_client.reset_mock()
+        StorageService._checked_buckets.clear()
 
-        # Setup MinIO client to return True for bucket_exists
-        mock_minio_client.bucket_exists.return_value = True
+        # Setup MinIO client to report the bucket or raise an error
+        mock_minio_client.bucket_exists.return_value = bucket_exists
+        mock_minio_client.bucket_exists.side_effect = error
 
         # Create a new instance to trigger _ensure_bucket_exists
-        with patch("src.services.storage_service.Minio", return_value=mock_minio_client):
-            storage_service = StorageService()
+        if error is not None:
+            with pytest.raises(RuntimeError) as excinfo:
+                StorageService()
 
-        # Verify bucket_exists was called with correct bucket name
-        mock_minio_client.bucket_exists.assert_called_once_with(storage_service.bucket_name)
+            assert "Failed to create bucket" in str(excinfo.value)
+            return
 
-        # Verify make_bucket was not called
-        mock_minio_client.make_bucket.assert_not_called()
+        storage_service = StorageService()
 
-    def test_init_bucket_doesnt_exist(self, mock_minio_client):
-        # Reset mock to ensure clean state
-        mock_minio_client.reset_mock()
+        # Verify bucket_exists was called with correct bucket name
+        mock_minio_client.bucket_exists.assert_called_once_with(storage_service.bucket_name)
 
-        # Setup MinIO client to return False for bucket_exists
-        mock_minio_client.bucket_exists.return_value = False
+        # Verify make_bucket was only called when the bucket was missing
+        if bucket_created:
+            mock_minio_client.make_bucket.assert_called_once_with(storage_service.bucket_name)
+        else:
+            mock_minio_client.make_bucket.assert_not_called()
 
-        # Create a new instance to trigger _ensure_bucket_exists
-        with patch("src.services.storage_service.Minio", return_value=mock_minio_client):
-            storage_service = StorageService()
+    def test_init_recompress_without_pillow(self, patched_minio, monkeypatch):
+        # Enable recompression with Pillow unimportable
+        monkeypatch.setattr(config.minio, "recompress_on_upload", True)
+        monkeypatch.setitem(sys.modules, "PIL", None)
+        monkeypatch.setitem(sys.modules, "PIL.Image", None)
 
-        # Verify bucket_exists was called with correct bucket name
-        mock_minio_client.bucket_exists.assert_called_once_with(storage_service.bucket_name)
+        # Verify the service refuses to start
+        with pytest.raises(RuntimeError) as excinfo:
+            StorageService()
 
-        # Verify make_bucket was called with correct bucket name
-        mock_minio_client.make_bucket.assert_called_once_with(storage_service.bucket_name)
+        assert "requires Pillow" in str(excinfo.value)
 
-    def test_init_bucket_error(self, mock_minio_client):
-        # Reset mock to ensure clean state
+    def test_init_bucket_checked_once(self, patched_minio, mock_minio_client):
+        # Reset mock and checked buckets to ensure clean state
         mock_minio_client.reset_mock()
+        StorageService._checked_buckets.clear()
 
-        # Setup MinIO client to raise a mock error
-        mock_minio_client.bucket_exists.side_effect = MockS3Error("Access Denied")
+        # Create two instances for the same bucket
+        StorageService()
+        StorageService()
 
-        # Create a new instance to trigger _ensure_bucket_exists
-        with patch("src.services.storage_service.Minio", return_value=mock_minio_client):
-            with patch("src.services.storage_service.S3Error", MockS3Error):
-                with pytest.raises(RuntimeError) as excinfo:
-                    storage_service = StorageService()
-
-                assert "Failed to create bucket" in str(excinfo.value)
+        # Verify the bucket was only checked by the first instance
+        mock_minio_client.bucket_exists.assert_called_once()
 
-    def test_upload_screenshot(self, storage_service, mock_minio_client, test_data):
+    def test_upload_screenshot(self, storage_service, mock_minio_client, test_data, monkeypatch):
         catalog_id = test_data["catalog_id"]
-        file_data = io.BytesIO(b"fake-screenshot-data")
+        # Buffered stream without a file descriptor, so its length is unknown
+        file_data = io.BufferedReader(io.BytesIO(FAKE_PAYLOAD))
         content_type = "image/jpeg"
 
-        # Create a UUID object with a known value
-        file_id_hex = "a1b2c3d4e5f6a1b2c3d4e5f6a1b2c3d4"
-        uuid_obj = uuid.UUID(file_id_hex)
-        # The string representation will have hyphens
-        file_id_str = str(uuid_obj)  # 'a1b2c3d4-e5f6-a1b2-c3d4-e5f6a1b2c3d4'
+        # Use a known random file id
+        monkeypatch.setattr("src.services.storage_service.secrets.token_hex", lambda nbytes: FILE_ID_STR)
 
         # Call the method
-        with patch("uuid.uuid4") as mock_uuid4:
-            mock_uuid4.return_value = uuid_obj
-            result = storage_service.upload_screenshot(catalog_id, file_data, content_type)
+        result = storage_service.upload_screenshot(catalog_id, file_data, content_type)
 
         # Verify put_object was called with correct parameters
         mock_minio_client.put_object.assert_called_once()
         args, kwargs = mock_minio_client.put_object.call_args
 
         assert kwargs["bucket_name"] == storage_service.bucket_name
-        # Use the string representation with hyphens to match the actual format
-        assert kwargs["object_name"] == f"{catalog_id}/{file_id_str}.jpg"
+        assert kwargs["object_name"] == f"{catalog_id}/{FILE_ID_STR}.jpg"
         assert kwargs["data"] == file_data
+        assert kwargs["length"] == -1
+        assert kwargs["part_size"] == storage_service.part_size
         assert kwargs["content_type"] == content_type
+        assert kwargs["num_parallel_uploads"] == storage_service.num_parallel_uploads
 
         # Verify result matches what the method returns
-        assert result == f"{catalog_id}/{file_id_str}.jpg"
+        assert result == f"{catalog_id}/{FILE_ID_STR}.jpg"
+
+    def test_upload_screenshot_known_length(self, storage_service, mock_minio_client, test_data):
+        file_data = io.BytesIO(FAKE_PAYLOAD)
+
+        # Call the method with the file length
+        storage_service.upload_screenshot(test_data["catalog_id"], file_data, "image/jpeg", length=len(FAKE_PAYLOAD))
+
+        # Verify length was passed through with the configured part size
+        args, kwargs = mock_minio_client.put_object.call_args
+        assert kwargs["length"] == len(FAKE_PAYLOAD)
+        assert kwargs["part_size"] == storage_service.part_size
+
+    def test_upload_screenshot_large_known_length_part_size(self, storage_service, mock_minio_client, test_data):
+        # Upload larger than MinIO's 5 MiB minimum part size
+        length = 20 * 1024 * 1024
+        storage_service.upload_screenshot(test_data["catalog_id"], io.BytesIO(), "image/jpeg", length=length)
+
+        # Verify MinIO splits the upload by the configured part size rather than its 5 MiB default
+        args, kwargs = mock_minio_client.put_object.call_args
+        part_size, part_count = get_part_info(kwargs["length"], kwargs["part_size"])
+        assert part_size == storage_service.part_size
+        assert part_count == -(-length // storage_service.part_size)
+
+    def test_upload_screenshot_bytesio_length(self, storage_service, mock_minio_client, test_data):
+        file_data = io.BytesIO(FAKE_PAYLOAD)
+        file_data.read(5)
+
+        storage_service.upload_screenshot(test_data["catalog_id"], file_data, "image/jpeg")
+
+        # Verify the unread length was taken from the buffer without moving the position
+        args, kwargs = mock_minio_client.put_object.call_args
+        assert kwargs["length"] == len(FAKE_PAYLOAD) - 5
+        assert file_data.tell() == 5
+
+    def test_upload_screenshot_recompress_png(self, storage_service, mock_minio_client, test_data):
+        image_module = pytest.importorskip("PIL.Image")
+
+        # Create a small PNG screenshot
+        png_data = io.BytesIO()
+        image_module.new("RGBA", (64, 64), (255, 0, 0, 255)).save(png_data, format="PNG")
+        png_data.seek(0)
+
+        storage_service.recompress_on_upload = True
+        storage_service.upload_screenshot(test_data["catalog_id"], png_data, "image/png")
+
+        # Verify a JPEG of known length was uploaded in place of the PNG
+        args, kwargs = mock_minio_client.put_object.call_args
+        assert kwargs["content_type"] == "image/jpeg"
+        assert kwargs["data"].getvalue()[:3] == b"\xff\xd8\xff"
+        assert kwargs["length"] == len(kwargs["data"].getvalue())
+        assert kwargs["part_size"] == storage_service.part_size
+
+    def test_upload_screenshot_recompress_disabled(self, storage_service, mock_minio_client, test_data):
+        file_data = io.BytesIO(FAKE_PAYLOAD)
+
+        storage_service.recompress_on_upload = False
+        storage_service.upload_screenshot(test_data["catalog_id"], file_data, "image/png")
+
+        # Verify the original upload was stored untouched
+        args, kwargs = mock_minio_client.put_object.call_args
+        assert kwargs["data"] is file_data
+        assert kwargs["content_type"] == "image/png"
+
+    @pytest.mark.parametrize("max_image_pixels, data", [
+        (None, b"not-an-image"),
+        (64, None),
+    ], ids=["malformed", "decompression_bomb"])
+    def test_upload_screenshot_recompress_failure(self, storage_service, mock_minio_client, test_data, monkeypatch,
+                                                  max_image_pixels, data):
+        image_module = pytest.importorskip("PIL.Image")
+
+        # Create a PNG too large for the pixel limit, unless the upload is not an image at all
+        if data is None:
+            png_data = io.BytesIO()
+            image_module.new("RGB", (64, 64)).save(png_data, format="PNG")
+            data = png_data.getvalue()
+        if max_image_pixels is not None:
+            monkeypatch.setattr(image_module, "MAX_IMAGE_PIXELS", max_image_pixels)
+
+        storage_service.recompress_on_upload = True
+        storage_service.upload_screenshot(test_data["catalog_id"], io.BytesIO(data), "image/png")
+
+        # Verify the original upload was stored instead
+        args, kwargs = mock_minio_client.put_object.call_args
+        assert kwargs["data"].getvalue() == data
+        assert kwargs["content_type"] == "image/png"
 
     def test_upload_screenshot_error(self, storage_service, mock_minio_client, test_data):
         catalog_id = test_data["catalog_id"]
-        file_data = io.BytesIO(b"fake-screenshot-data")
+        file_data = io.BytesIO(FAKE_PAYLOAD)
         content_type = "image/jpeg"
 
         # Setup MinIO client to raise an error
         mock_minio_client.put_object.side_effect = MockS3Error("Internal Error")
 
         # Call the method and expect exception
-        with patch("src.services.storage_service.S3Error", MockS3Error):
-            with pytest.raises(RuntimeError) as excinfo:
-                storage_service.upload_screenshot(catalog_id, file_data, content_type)
+        with pytest.raises(RuntimeError) as excinfo:
+            storage_service.upload_screenshot(catalog_id, file_data, content_type)
 
-            assert "Failed to upload screenshot" in str(excinfo.value)
+        assert "Failed to upload screenshot" in str(excinfo.value)
 
     def test_get_screenshot_url(self, storage_service, mock_minio_client):
         object_name = "test-catalog/test-uuid.jpg"
@@ -119,7 +214,7 @@ class TestStorageService:
         mock_minio_client.presigned_get_object.assert_called_once_with(
             bucket_name=storage_service.bucket_name,
             object_name=object_name,
-            expires=3600
+            expires=timedelta(hours=1)
         )
 
         # Verify result
@@ -132,8 +227,7 @@ class TestStorageService:
         mock_minio_client.presigned_get_object.side_effect = MockS3Error("Internal Error")
 
         # Call the method and expect exception
-        with patch("src.services.storage_service.S3Error", MockS3Error):
-            with pytest.raises(RuntimeError) as excinfo:
-                storage_service.get_screenshot_url(object_name)
+        with pytest.raises(RuntimeError) as excinfo:
+            storage_service.get_screenshot_url(object_name)
 
-            assert "Failed to generate presigned URL" in str(excinfo.value)
+        assert "Failed to generate presigned URL" in str(excinfo.value)
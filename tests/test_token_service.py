@@ -1,150 +1,251 @@
-import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import ANY, MagicMock
 
-from freezegun import freeze_time
+import jwt
+import pytest
 
 from src.models import TokenBlacklistReason
-from tests.conftest import *  # Import all fixtures
+from src.services.token_service import TokenService
+from tests.fakes import FakeClock
 
 
 @pytest.mark.unit
 class TestTokenService:
-    def test_create_token(self, token_service, test_data):
+    def test_create_token(self, mock_redis, jwt_config, test_data, monkeypatch, patched_jwt_encode):
         peer_id = test_data["peer_id"]
         catalog_id = test_data["catalog_id"]
         request_id = test_data["request_id"]
         token_id = test_data["token_id"]
 
-        # Use a mock for uuid4 instead of trying to create a real UUID
-        mock_uuid = MagicMock()
-        mock_uuid.hex = token_id
-        mock_uuid.__str__.return_value = token_id
-
-        # Explicitly patch jwt.encode to return "mocked-jwt-token"
-        with patch("src.services.token_service.jwt.encode", return_value="mocked-jwt-token"):
-            with patch("uuid.uuid4", return_value=mock_uuid):
-                with freeze_time("2025-05-13 12:00:00"):
-                    token_info = token_service.create_token(peer_id, catalog_id, request_id)
-
-                    assert token_info.peer_id == peer_id
-                    assert token_info.catalog_id == catalog_id
-                    assert token_info.request_id == request_id
-                    assert token_info.token_id == token_id
-                    assert token_info.token == "mocked-jwt-token"
-
-                    # Verify jwt.encode was called with correct parameters
-                    # We need to use the patched version from the context
-                    from src.services.token_service import jwt as patched_jwt
-                    patched_jwt.encode.assert_called_once()
-                    args, kwargs = patched_jwt.encode.call_args
-
-                    payload = args[0]
-                    assert payload["peer_id"] == peer_id
-                    assert payload["catalog_id"] == catalog_id
-                    assert payload["request_id"] == request_id
-                    assert payload["token_id"] == token_id
-                    assert "exp" in payload
-
-                    assert kwargs["algorithm"] == "HS256"
-
-    def test_validate_token_valid(self, token_service, mock_redis, test_data, sample_token_payload):
-        # Setup mock Redis to indicate token is not blacklisted
-        mock_redis.exists.return_value = False
-
-        # We need to ensure jwt.decode returns a correctly formatted payload
-        # Let's patch it directly inside this test
-        with patch.object(jwt, 'decode', return_value={
-            "peer_id": sample_token_payload.peer_id,
-            "catalog_id": sample_token_payload.catalog_id,
-            "request_id": sample_token_payload.request_id,
-            "token_id": sample_token_payload.token_id,
-            "exp": sample_token_payload.exp.timestamp()
-        }):
-            result = token_service.validate_token("valid-token")
-
-            # Verify token validation
-            assert result is not None
-            assert result.peer_id == sample_token_payload.peer_id
-            assert result.catalog_id == sample_token_payload.catalog_id
-            assert result.request_id == sample_token_payload.request_id
-            assert result.token_id == sample_token_payload.token_id
-
-            # Verify Redis check
-            redis_key = f"{token_service.redis_config.token_blacklist_prefix}{sample_token_payload.token_id}"
-            mock_redis.exists.assert_called_once_with(redis_key)
-
-    def test_validate_token_blacklisted(self, token_service, mock_redis, test_data):
+        # Freeze the clock the service reads and use a known token id
+        frozen_time = datetime(2025, 5, 13, 12, tzinfo=timezone.utc).timestamp()
+        monkeypatch.setattr("src.services.token_service.time", FakeClock(frozen_time))
+        monkeypatch.setattr("src.services.token_service.secrets.token_hex", lambda nbytes: token_id)
+
+        # Sign through PyJWT, which is patched to return "mocked-jwt-token"
+        monkeypatch.setattr(jwt_config, "fast_signing", False)
+        token_service = TokenService(mock_redis)
+        token_info = token_service.create_token(peer_id, catalog_id, request_id)
+
+        assert token_info.peer_id == peer_id
+        assert token_info.catalog_id == catalog_id
+        assert token_info.request_id == request_id
+        assert token_info.token_id == token_id
+        assert token_info.token == "mocked-jwt-token"
+
+        # Verify jwt.encode was called once with correct parameters
+        expected_payload = {
+            "peer_id": peer_id,
+            "catalog_id": catalog_id,
+            "request_id": request_id,
+            "token_id": token_id,
+            "exp": datetime(2025, 5, 13, 12, 30, tzinfo=timezone.utc).timestamp(),
+        }
+        assert patched_jwt_encode.calls == [(expected_payload, ANY, "HS256")]
+
+    def test_create_token_fast_signing(self, token_service, test_data):
+        token_info = token_service.create_token(test_data["peer_id"], test_data["catalog_id"], test_data["request_id"])
+
+        # Verify the pre-keyed HMAC signature is accepted by PyJWT
+        header = jwt.get_unverified_header(token_info.token)
+        payload = jwt.decode(token_info.token, test_data["jwt_secret"], algorithms=["HS256"])
+
+        assert header == {"alg": "HS256", "typ": "JWT"}
+        assert payload["peer_id"] == test_data["peer_id"]
+        assert payload["catalog_id"] == test_data["catalog_id"]
+        assert payload["request_id"] == test_data["request_id"]
+        assert payload["token_id"] == token_info.token_id
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("decode_error, stored_reason, expected_reason", [
+        (None, None, None),
+        (None, TokenBlacklistReason.ALREADY_USED, TokenBlacklistReason.ALREADY_USED),
+        (jwt.InvalidTokenError("Invalid token"), None, None),
+    ], ids=["valid", "blacklisted", "invalid"])
+    async def test_validate_token(self, token_service, mock_redis, sample_token_payload, patched_jwt_decode,
+                                  decode_error, stored_reason, expected_reason):
+        # Setup mock Redis with the stored blacklist reason, if any
+        mock_redis.get.return_value = stored_reason.value.encode('utf-8') if stored_reason else None
+
+        # Make jwt.decode raise for invalid tokens
+        patched_jwt_decode.side_effect = decode_error
+
+        result = await token_service.validate_token("test-token")
+
+        # Verify token validation fails without a blacklist lookup for invalid tokens
+        if decode_error is not None:
+            assert result.payload is None
+            assert result.token_id is None
+            mock_redis.get.assert_not_called()
+            return
+
+        # Verify token validation
+        assert result.reason == expected_reason
+        if expected_reason is None:
+            assert result.payload == sample_token_payload
+        else:
+            assert result.payload is None
+
+        # Verify Redis check
+        mock_redis.get.assert_called_once_with(token_service._blacklist_key(sample_token_payload.token_id))
+
+    @pytest.mark.asyncio
+    async def test_validate_token_cached(self, token_service, mock_redis, patched_jwt_decode):
+        mock_redis.get.return_value = None
+
+        first = await token_service.validate_token("valid-token")
+        second = await token_service.validate_token("valid-token")
+
+        # Verify signature was only verified once
+        patched_jwt_decode.assert_called_once()
+        assert first == second
+
+        # Verify blacklist is still checked on every call
+        assert mock_redis.get.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_validate_token_cached_blacklisted(self, token_service, mock_redis, patched_jwt_decode):
+        mock_redis.get.return_value = None
+
+        assert (await token_service.validate_token("valid-token")).payload is not None
+
+        # Blacklist token after it has been cached
+        mock_redis.get.return_value = TokenBlacklistReason.OTHER_PEER_UPLOADED.value.encode('utf-8')
+
+        result = await token_service.validate_token("valid-token")
+        assert result.payload is None
+        assert result.reason == TokenBlacklistReason.OTHER_PEER_UPLOADED
+
+    @pytest.mark.asyncio
+    async def test_validate_token_missing_claim(self, token_service, mock_redis, test_data):
+        # Create a correctly signed token without a request_id claim
+        token = jwt.encode(
+            {
+                "peer_id": test_data["peer_id"],
+                "catalog_id": test_data["catalog_id"],
+                "token_id": test_data["token_id"],
+                "exp": (datetime.now() + timedelta(minutes=30)).timestamp()
+            },
+            test_data["jwt_secret"],
+            algorithm="HS256"
+        )
+
+        result = await token_service.validate_token(token)
+
+        # Verify token is rejected as invalid
+        assert result.payload is None
+        assert result.token_id == test_data["token_id"]
+
+    @pytest.mark.asyncio
+    async def test_validate_token_expired_blacklisted(self, token_service, mock_redis, test_data, monkeypatch):
         # Setup mock Redis to indicate token is blacklisted
-        mock_redis.exists.return_value = True
-
-        # Mock jwt.decode to return a valid payload so we reach the Redis check
-        with patch.object(jwt, 'decode', return_value={
-            "peer_id": test_data["peer_id"],
-            "catalog_id": test_data["catalog_id"],
-            "request_id": test_data["request_id"],
-            "token_id": test_data["token_id"],
-            "exp": (datetime.now() + timedelta(minutes=30)).timestamp()
-        }):
-            result = token_service.validate_token("blacklisted-token")
-
-            # Verify token validation fails
-            assert result is None
-
-            # Verify Redis check
-            redis_key = f"{token_service.redis_config.token_blacklist_prefix}{test_data['token_id']}"
-            mock_redis.exists.assert_called_once_with(redis_key)
-
-    def test_validate_token_invalid(self, token_service):
-        # Setup JWT to raise an exception
-        with patch("src.services.token_service.jwt.decode", side_effect=jwt.JWTError("Invalid token")):
-            result = token_service.validate_token("invalid-token")
-
-            # Verify token validation fails
-            assert result is None
-
-    def test_blacklist_token(self, token_service, mock_redis, test_data):
+        mock_redis.get.return_value = TokenBlacklistReason.ALREADY_USED.value.encode('utf-8')
+
+        # Create a token that has already expired
+        token = jwt.encode(
+            {"token_id": test_data["token_id"], "exp": (datetime.now() - timedelta(minutes=1)).timestamp()},
+            "any-secret",
+            algorithm="HS256"
+        )
+
+        # Track signature verification
+        decode_mock = MagicMock()
+        monkeypatch.setattr("src.services.token_service.jwt.decode", decode_mock)
+
+        result = await token_service.validate_token(token)
+
+        # Verify expired token is rejected without verifying its signature
+        decode_mock.assert_not_called()
+
+        # Verify blacklist reason is reported for the rejected token
+        assert result.payload is None
+        assert result.token_id == test_data["token_id"]
+        assert result.reason == TokenBlacklistReason.ALREADY_USED
+
+    @pytest.mark.asyncio
+    async def test_validate_token_replayed_skips_verification(self, token_service, mock_redis, test_data,
+                                                             monkeypatch):
+        # Blacklist token locally, as after an upload
+        await token_service.blacklist_token(test_data["token_id"], TokenBlacklistReason.ALREADY_USED)
+
+        token = jwt.encode(
+            {"token_id": test_data["token_id"], "exp": (datetime.now() + timedelta(minutes=30)).timestamp()},
+            "any-secret",
+            algorithm="HS256"
+        )
+
+        # Track signature verification
+        decode_mock = MagicMock()
+        monkeypatch.setattr("src.services.token_service.jwt.decode", decode_mock)
+
+        result = await token_service.validate_token(token)
+
+        # Verify replayed token is rejected without verification or Redis
+        decode_mock.assert_not_called()
+        mock_redis.get.assert_not_called()
+
+        assert result.payload is None
+        assert result.reason == TokenBlacklistReason.ALREADY_USED
+
+    def test_blacklist_key(self, token_service, test_data):
+        # Verify the key is the configured prefix followed by the token id, as bytes
+        expected_key = f"{token_service.redis_config.token_blacklist_prefix}{test_data['token_id']}".encode("utf-8")
+        assert token_service._blacklist_key(test_data["token_id"]) == expected_key
+
+    @pytest.mark.asyncio
+    async def test_blacklist_token(self, token_service, mock_redis, test_data):
         token_id = test_data["token_id"]
         reason = TokenBlacklistReason.ALREADY_USED
         ttl_hours = 24
 
-        token_service.blacklist_token(token_id, reason, ttl_hours)
+        await token_service.blacklist_token(token_id, reason, ttl_hours)
 
         # Verify Redis setex was called with correct parameters
-        blacklist_key = f"{token_service.redis_config.token_blacklist_prefix}{token_id}"
         mock_redis.setex.assert_called_once()
         args, kwargs = mock_redis.setex.call_args
 
-        assert args[0] == blacklist_key
-        assert isinstance(args[1], timedelta)
-        assert args[1].total_seconds() == ttl_hours * 3600
-        assert args[2] == reason.value
+        assert args[0] == token_service._blacklist_key(token_id)
+        assert args[1] == ttl_hours * 3600
+        assert args[2] == reason.value.encode("utf-8")
 
-    def test_get_blacklist_reason_exists(self, token_service, mock_redis, test_data):
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("reason", [TokenBlacklistReason.ALREADY_USED, None], ids=["exists", "not_exists"])
+    async def test_get_blacklist_reason(self, token_service, mock_redis, test_data, reason):
         token_id = test_data["token_id"]
-        reason = TokenBlacklistReason.ALREADY_USED
 
-        # Setup Redis to return a reason
-        mock_redis.get.return_value = reason.value.encode("utf-8")
+        # Setup Redis to return the reason, if any
+        mock_redis.get.return_value = reason.value.encode("utf-8") if reason else None
 
-        result = token_service.get_blacklist_reason(token_id)
+        result = await token_service.get_blacklist_reason(token_id)
 
         # Verify Redis get was called with correct key
-        blacklist_key = f"{token_service.redis_config.token_blacklist_prefix}{token_id}"
-        mock_redis.get.assert_called_once_with(blacklist_key)
+        mock_redis.get.assert_called_once_with(token_service._blacklist_key(token_id))
 
         # Verify result
         assert result == reason
 
-    def test_get_blacklist_reason_not_exists(self, token_service, mock_redis, test_data):
+    @pytest.mark.asyncio
+    async def test_get_blacklist_reason_cached(self, token_service, mock_redis, test_data):
         token_id = test_data["token_id"]
+        reason = TokenBlacklistReason.OTHER_PEER_UPLOADED
 
-        # Setup Redis to return None
-        mock_redis.get.return_value = None
+        # Setup Redis to return a reason
+        mock_redis.get.return_value = reason.value.encode("utf-8")
 
-        result = token_service.get_blacklist_reason(token_id)
+        first = await token_service.get_blacklist_reason(token_id)
+        second = await token_service.get_blacklist_reason(token_id)
 
-        # Verify Redis get was called with correct key
-        blacklist_key = f"{token_service.redis_config.token_blacklist_prefix}{token_id}"
-        mock_redis.get.assert_called_once_with(blacklist_key)
+        # Verify Redis was only queried once for a blacklisted token
+        mock_redis.get.assert_called_once()
+        assert first == second == reason
 
-        # Verify result
-        assert result is None
\ No newline at end of file
+    @pytest.mark.asyncio
+    async def test_get_blacklist_reason_after_blacklist_token(self, token_service, mock_redis, test_data):
+        token_id = test_data["token_id"]
+
+        await token_service.blacklist_token(token_id, TokenBlacklistReason.ALREADY_USED)
+        result = await token_service.get_blacklist_reason(token_id)
+
+        # Verify the locally blacklisted token is answered without Redis
+        mock_redis.get.assert_not_called()
+        assert result == TokenBlacklistReason.ALREADY_USED